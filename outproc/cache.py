@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Persistent per-user cache helpers
+
+    NOTE This module is used by the bypass path, so it must import
+    nothing but a bare minimum!
+'''
+
+# Standard imports
+import os
+
+
+def cache_dir():
+    '''Get a per-user cache directory'''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'outproc')
+
+
+def read_file(*parts):
+    '''Get contents of a cache file or `None` if there is no such file'''
+    try:
+        with open(os.path.join(cache_dir(), *parts), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_file(data, *parts):
+    ''' Atomically replace a cache file w/ given data
+
+        Return `False` if the cache is not writable (it is not an error).
+    '''
+    filename = os.path.join(cache_dir(), *parts)
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, filename)
+    except OSError:
+        try:
+            os.unlink(temp_filename)
+        except OSError:
+            pass
+        return False
+    return True
@@ -20,10 +20,16 @@
 
 
 # Project specific imports
+import outproc.daemon
+import outproc.parallel
 import outproc.pp
+import outproc.reader
+import outproc.sgr
+import outproc.stats
 from outproc.config import Config
-from outproc.logger import log
-from outproc.processing import Processor, report_error_with_backtrace, SYSCONFDIR
+from outproc.processing import ChildWatcher, find_config_file, HANDOFF_MARKER, handoff_environment, \
+    handoff_requested, Processor, report_error_with_backtrace
+from outproc.resolver import find_wrapped_binary
 
 # Standard imports
 import argparse
@@ -32,10 +38,15 @@ import fcntl
 import os
 import pathlib
 import pkgutil
-import select
+import pty
+import signal
 import subprocess
 import sys
-import traceback
+import termios
+
+
+# Size of a block to read from STDIN in pipe mode
+_PIPE_MODE_BLOCK_SIZE = 256 * 1024
 
 
 class Application:
@@ -45,6 +56,11 @@ class Application:
         self.real_executable_name = self.executable_name.resolve()
         self.basename = self.executable_name.name
         self.pipe_mode = False
+        self.daemon_mode = False
+        self.resolve = []
+        # Mark output lines as final if an outer instance reads them
+        self.mark_lines = handoff_requested()
+        self.minimize_escapes = False
 
 
     def _handle_command_line(self):
@@ -61,9 +77,25 @@ class Application:
           , metavar='NAME'
           , help='Choose module to process input from STDIN'
           )
+        parser.add_argument(
+            '-d'
+          , '--daemon'
+          , action='store_true'
+          , help='Run a daemon to keep modules and configs warm for wrapped executables'
+          )
+        parser.add_argument(
+            '-r'
+          , '--resolve'
+          , metavar='NAME'
+          , nargs='+'
+          , default=[]
+          , help='Find and remember executables wrapped by given modules'
+          )
         args = parser.parse_args()
 
         self.list_modules = args.list_modules
+        self.resolve = args.resolve
+        self.daemon_mode = args.daemon
 
         # Override module name if running as `outproc`. I.e. in a command like this:
         #  $ /usr/bin/make 2>&1 | outproc -m make
@@ -74,16 +106,19 @@ class Application:
 
     def _find_wrapped_binary(self):
         # Try to find a wrapped executable
-        self.binary = None
-        for path in map(lambda p: pathlib.Path(p), os.environ['PATH'].split(os.pathsep)):
-            binary = path / self.basename
-            # If given binary exists and is not the same executable as the current one
-            if binary.exists() and binary.resolve() != self.real_executable_name and 'outproc' not in binary.parts:
-                self.binary = binary
-                break
-
-        if self.binary is None:
+        binary = find_wrapped_binary(self.basename, str(self.real_executable_name))
+        if binary is None:
             raise RuntimeError('Command not found: {}'.format(self.basename))
+        self.binary = pathlib.Path(binary)
+
+
+    def _resolve_binaries(self):
+        '''Find (and remember) executables to wrap by given modules'''
+        for name in self.resolve:
+            binary = find_wrapped_binary(name, str(self.real_executable_name), use_cache=False)
+            if binary is None:
+                raise RuntimeError('Command not found: {}'.format(name))
+            print('{} -> {}'.format(name, binary))
 
 
     def _list_pp_modules(self):
@@ -111,22 +146,14 @@ class Application:
             raise RuntimeError('Module {} does not provide class `Processor`'.format(self.pp_mod.__name__))
 
 
-    def _load_config(self, config_file_name):
-        # Try user config file first
-        config_file_name_full = None
-        if 'HOME' in os.environ:
-            config_file_name_full = pathlib.Path.home() / '.outproc' / config_file_name
-            # If no user config, then will try a system-wide
-            if not config_file_name_full.exists():
-                config_file_name_full = None
-
-        # Set full config file name to the system-wide if still not inilialized
-        if config_file_name_full is None:
-            config_file_name_full = pathlib.Path(SYSCONFDIR) / config_file_name
+    def _config_file_path(self, config_file_name):
+        return find_config_file(config_file_name)
+
 
+    def _load_config(self, config_file_name):
         # Try to load configuration for selected plugin
         try:
-            return Config(config_file_name_full)
+            return Config(self._config_file_path(config_file_name))
         except:
             raise RuntimeError('Unable to load configuration data')
 
@@ -134,37 +161,179 @@ class Application:
     def _create_output_processor(self, config):
         try:
             # Make an instance of an output processor
-            return self.pp_mod.Processor(config, str(self.binary))
+            processor = self.pp_mod.Processor(config, str(self.binary))
         except:
             raise RuntimeError('Unable to make a preprocessor instance')
+        config.save_cache()                                 # Remember colors requested by the processor
+        self.minimize_escapes = config.get_bool('minimize-escapes', True)
 
+        workers = config.get_int('parallel-workers', 0)
+        if 1 < workers and outproc.parallel.ParallelProcessor.supported_by(processor):
+            processor = outproc.parallel.ParallelProcessor(processor, workers)
+        return processor
 
-    def _make_async(self, fd):
-        '''Switch given file descriptor to asynchronous mode'''
-        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
 
+    def _copy_window_size(self, fd):
+        '''Set a window size of a given terminal the same as of the current STDOUT'''
+        try:
+            size = fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, b'\0' * 8)
+            fcntl.ioctl(fd, termios.TIOCSWINSZ, size)
+        except OSError:
+            pass                                            # STDOUT is not a terminal
+
+
+    def _open_pty(self):
+        master, slave = pty.openpty()
+        # Do not translate '\n' into '\r\n'
+        attrs = termios.tcgetattr(slave)
+        attrs[1] &= ~termios.ONLCR
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        # Keep the window size in sync w/ the real terminal
+        self._copy_window_size(master)
+        signal.signal(signal.SIGWINCH, lambda signum, frame: self._copy_window_size(master))
+        return (master, slave)
+
+
+    def _start_wrapped_binary(self, use_pty=False, handoff=False):
+        ''' Start the wrapped binary
+
+            Return a tuple of a process and a stream to read its output from.
+
+            If `use_pty` is set, the wrapped binary would write to a pseudo-terminal,
+            so it wouldn't switch to full buffering (and wouldn't suppress
+            progress messages or colors).
+
+            If `handoff` is set, nested wrappers would mark lines they have processed
+            (see `Processor.handoff`).
+        '''
+        if use_pty:
+            master, slave = self._open_pty()
+        else:
+            master, slave = os.pipe()
+            outproc.reader.enlarge_pipe(master)
 
-    def _start_wrapped_binary(self):
         try:
             # Execute wrapped (and found) binary
-            return subprocess.Popen(
+            process = subprocess.Popen(
                 [str(self.binary)] + sys.argv[1:]
-              , bufsize=1                                   # Per line buffering
               , stdin=sys.stdin                             # TODO Need to pass input to subprocess as well
-              , stdout=subprocess.PIPE
+              , stdout=slave
               , stderr=subprocess.STDOUT                    # NOTE Redirect STDERR to STDOUT
               , shell=False                                 # No shell needed
+              , env=handoff_environment(slave) if handoff else None
               )
         except:
             raise RuntimeError('Unable to start wrapped executable ({})'.format(self.binary))
+        finally:
+            os.close(slave)                                 # Only the child should hold it
+
+        return (process, open(master, 'rb'))
 
 
     def _out_lines_list(self, lines):
         if lines:
-            sys.stdout.write('\n'.join(lines) + '\n')
+            text = '\n'.join(lines)
+            if self.minimize_escapes:
+                text = outproc.sgr.optimize(text)
+            if self.mark_lines:
+                # NOTE Processed lines may have line breaks, but every one has to be marked
+                text = HANDOFF_MARKER + text.replace('\n', '\n' + HANDOFF_MARKER)
+            sys.stdout.write(text + '\n')
             sys.stdout.flush()
 
 
+    def _process_output(self, processor, stream, watcher=None):
+        ''' Process output of a wrapped executable
+
+            Reading is done by a separate thread, so the wrapped executable
+            wouldn't block on a full pipe while lines are being processed.
+            If a `watcher` is given, stop shortly after it reports the wrapped executable
+            has exited, even if its output is still held open by some descendant process.
+        '''
+        buffer = outproc.reader.BlockBuffer()
+        reader = outproc.reader.Reader(stream, buffer, watcher)
+        reader.start()
+
+        data = buffer.take()
+        while data is not None:
+            self._out_lines_list(processor.handle_block(data))
+            data = buffer.take()
+
+        reader.join()
+        outproc.stats.maximum('backlog-max-bytes', buffer.max_size)
+        outproc.stats.add('reader-stall-seconds', buffer.stall_time)
+        if reader.error is not None:
+            raise reader.error
+
+        self._out_lines_list(processor.eof())               # Notify processor about EOF
+
+
+    def _process_input(self, processor, fd):
+        '''Process data from a (blocking) file descriptor until EOF'''
+        while True:
+            try:
+                block = os.read(fd, _PIPE_MODE_BLOCK_SIZE)
+            except InterruptedError:
+                continue
+            if not block:
+                break
+            self._out_lines_list(processor.handle_block(block))
+        self._out_lines_list(processor.eof())               # Notify processor about EOF
+
+
+    def _run_pipe_mode(self):
+        self._load_pp_module()
+        config = self._load_config(self.pp_mod.Processor.config_file_name(self.basename))
+        # NOTE There is no wrapped executable in pipe mode, so a module name
+        # is the best guess for processors interested in it
+        self.binary = pathlib.Path(self.basename)
+        processor = self._create_output_processor(config)
+        self._process_input(processor, sys.stdin.fileno())
+        return exitstatus.ExitStatus.success
+
+
+    def _try_run_via_daemon(self):
+        '''Let a running daemon process the output. Return `None` if there is no daemon.'''
+        client = outproc.daemon.Client.connect()
+        if client is None:
+            return None
+
+        process = None
+        try:
+            reply = client.request(self.basename, str(self.binary))
+            if reply is None:
+                return None
+
+            # Plugin may alter command line options or environment
+            sys.argv = reply['argv']
+            os.environ.update(reply['env'])
+            for key in reply['unset']:
+                os.environ.pop(key, None)
+
+            if reply['action'] == 'exec':
+                # Ok, replace self w/ wrapped executable
+                os.execv(str(self.binary), [str(self.binary)] + sys.argv[1:])
+                return exitstatus.ExitStatus.failure
+
+            process, output = self._start_wrapped_binary(reply['pty'], reply['handoff'])
+            client.attach(output.fileno())
+            output.close()                                  # Now it is the daemon's business
+            watcher = ChildWatcher(process)
+            try:
+                client.wait(watcher)
+            finally:
+                watcher.close()
+            return process.wait()
+
+        except (OSError, ValueError):
+            # If the daemon has failed during a handshake, the wrapped
+            # binary is not started yet and can be handled in-process
+            return None if process is None else process.wait()
+
+        finally:
+            client.close()
+
+
     def run(self):
         # Check the binary name
         if self.executable_name == self.real_executable_name:
@@ -172,12 +341,21 @@ class Application:
             if self.list_modules:
                 self._list_pp_modules()
                 return exitstatus.ExitStatus.success
+            elif self.resolve:
+                self._resolve_binaries()
+                return exitstatus.ExitStatus.success
+            elif self.daemon_mode:
+                outproc.daemon.serve(Application)
+                return exitstatus.ExitStatus.success
             elif self.pipe_mode:
-                # TODO
-                log.eerror('Pipe mode not implemented')
-                return exitstatus.ExitStatus.failure
+                return self._run_pipe_mode()
 
         self._find_wrapped_binary()
+
+        result = self._try_run_via_daemon()
+        if result is not None:
+            return result
+
         self._load_pp_module()
         if not self.pp_mod.Processor.want_to_handle_current_command():
             # Ok, replace self w/ wrapped executable
@@ -185,54 +363,41 @@ class Application:
             return exitstatus.ExitStatus.failure
 
         config = self._load_config(self.pp_mod.Processor.config_file_name(self.basename))
+        return self._run_wrapped_binary(config)
+
+
+    def _run_wrapped_binary(self, config):
         processor = self._create_output_processor(config)
-        process = self._start_wrapped_binary()
-
-        po = select.epoll()                                 # Make a poll object
-        self._make_async(process.stdout)                    # Switch STDOUT descriptor to asynchronous mode
-        # Register descriptor for polling
-        po.register(process.stdout, select.EPOLLIN | select.EPOLLHUP)
-
-        eof = False
-        while not eof:
-            # Wait for data to become available
-            events = None
-            while events is None:
-                try:
-                    events = po.poll()
-                    break
-                except InterruptedError:                    # Handle EAGAIN:
-                    continue                                # just try to poll() once again ;)
-
-            # Analyze event
-            for fileno, event in events:
-                # Check if input available
-                if event & select.EPOLLIN:
-                    block = process.stdout.read()           # Read collected data
-                    while block is not None and block:
-                        self._out_lines_list(processor.handle_block(block))
-                        block = process.stdout.read()       # Try to read more data
-                elif event & select.EPOLLHUP:
-                    eof = True
-                    self._out_lines_list(processor.eof())   # Notify processor about EOF
-                else:
-                    assert False, 'Unexpected event {}'.format(event)
-
-        result = None
-        while result is None:
-            result = process.poll()                         # Try to get child exit status
+        process, output = self._start_wrapped_binary(
+            config.get_bool('use-pty', False)
+          , self.pp_mod.Processor.handoff
+          )
 
-        return result
+        watcher = ChildWatcher(process)
+        try:
+            self._process_output(processor, output, watcher)
+        finally:
+            watcher.close()
+            output.close()
+
+        return process.wait()                               # Get child exit status
 
 
 def main():
     try:
         a = Application()
-        return a.run()
+        result = a.run()
+        outproc.stats.report()
+        return result
 
     except KeyboardInterrupt:
         return exitstatus.ExitStatus.failure
 
+    except BrokenPipeError:
+        # Output consumer has gone away (e.g. `outproc -m make < build.log | head`)
+        sys.stderr.close()
+        return exitstatus.ExitStatus.failure
+
     except RuntimeError as ex:
         report_error_with_backtrace('Error: {}'.format(ex))
         return exitstatus.ExitStatus.failure
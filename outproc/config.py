@@ -17,12 +17,20 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Project specific imports
+from . import __version__, cache
+
+# Standard imports
+import json
 import os
 import pathlib
 import re
 import termcolor
 
 
+_CACHE_SUBDIR = 'configs'
+
+
 class Config:
     ''' Simple configuration data accessor
 
@@ -36,8 +44,12 @@ class Config:
     _RGB_HEX_COLOR_SPEC_RE = re.compile('rgb\s*\(\s*([0-9]{6})\s*\)')
     _GRAYSCALE_SPEC_RE = re.compile('gray\s*\(\s*([0-9]+)\s*\)')
 
-    def __init__(self, filename):
-        ''' Read configuration data from a given file '''
+    def __init__(self, filename, use_cache=True):
+        ''' Read configuration data from a given file
+
+            If `use_cache` is set, try to get data (and colors resolved) from
+            the cache (see `save_cache()`) instead of parsing.
+        '''
 
         assert isinstance(filename, pathlib.Path)
 
@@ -45,6 +57,10 @@ class Config:
         self.filename = filename
         # Make an empty dict for configuration data
         self.data = {}
+        # Resolved colors (see `get_color()`)
+        self.colors = {}
+        self.cache_key = None
+        self.cache_is_dirty = False
 
         # Set some predefined values
         # TODO Replace w/ `enum`
@@ -58,8 +74,15 @@ class Config:
         # NOTE Konsole terminal from KDE supports itallic font style
         termcolor.ATTRIBUTES['itallic'] = 3
 
-        if not filename.exists():
+        try:
+            st = filename.stat()
+        except OSError:
+            return                                          # No such file
+
+        self.cache_key = [__version__, os.path.abspath(str(filename)), st.st_mtime_ns, st.st_size]
+        if use_cache and self._load_cache():
             return
+        self.cache_is_dirty = True
 
         # Read the file line by line, and collect keys and values into an internal dict
         # TODO Use configparser
@@ -75,6 +98,37 @@ class Config:
                 self.data[key] = value
 
 
+    def _cache_file_name(self):
+        return self.cache_key[1].strip(os.sep).replace(os.sep, '!') + '.json'
+
+
+    def _load_cache(self):
+        data = cache.read_file(_CACHE_SUBDIR, self._cache_file_name())
+        if data is None:
+            return False
+        try:
+            entry = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return False
+        if not isinstance(entry, dict) or entry.get('key') != self.cache_key:
+            return False
+        self.data = entry['data']
+        self.colors = entry['colors']
+        return True
+
+
+    def save_cache(self):
+        ''' Store data and colors resolved so far (if anything has changed)
+
+            The next time the same (unmodified) file would be loaded w/o any parsing.
+        '''
+        if not self.cache_is_dirty or self.cache_key is None:
+            return
+        entry = {'key': self.cache_key, 'data': self.data, 'colors': self.colors}
+        cache.write_file(json.dumps(entry).encode('utf-8'), _CACHE_SUBDIR, self._cache_file_name())
+        self.cache_is_dirty = False
+
+
     def get_string(self, key, default=None):
         ''' Get string key value or default if absent '''
         assert isinstance(key, str)
@@ -126,7 +180,18 @@ class Config:
         assert isinstance(key, str)
         assert isinstance(default, str) or default is not None
 
-        colors = [c.strip() for c in (self.data[key] if key in self.data else default).split('+')]
+        spec = self.data[key] if key in self.data else default
+        color_key = ('+' if with_reset else '-') + spec
+        result = self.colors.get(color_key)
+        if result is None:
+            result = self._resolve_color(key, spec, with_reset)
+            self.colors[color_key] = result
+            self.cache_is_dirty = True
+        return result
+
+
+    def _resolve_color(self, key, spec, with_reset):
+        colors = [c.strip() for c in spec.split('+')]
         result = ''
 
         # Handle special value 'none' as color inhibitor
@@ -17,16 +17,15 @@
 # You should have received a copy of the GNU General Public License along
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 import collections
 import re
-import os
-import termcolor
 
 
 class SimpleCppLexer(object):
     ''' Helper class to get C++ lexems to be highlighted'''
 
-    _IDENTIFIER_RE = re.compile('[A-Za-z_][A-Za-z_0-9]*')
+    _IDENTIFIER_START = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_')
     # TODO A real expression to match numbers is much more complicated!
     # (and not so naive/stupid) Do we really need it? This one covers
     # most seen cases...
@@ -117,9 +116,11 @@ class SimpleCppLexer(object):
       , 'void'
       ]
 
-    _STRING_PREFIXES = ['u', 'U', 'L', 'u8', 'R', 'uR', 'UR', 'u8R', 'LR']
+    _STRING_PREFIXES = frozenset(['u', 'U', 'L', 'u8', 'R', 'uR', 'UR', 'u8R', 'LR'])
 
     class Token:
+        __slots__ = ('token', 'kind')
+
         BUILTIN_TYPE = 0
         IDENTIFIER = 1
         KEYWORD = 2
@@ -149,179 +150,91 @@ class SimpleCppLexer(object):
         def __repr__(self):
             return "{}('{}')".format(self.__KIND_STRINGS[self.kind], self.token)
 
+    _WORD_KINDS = {
+        **dict.fromkeys(_KEYWORDS, Token.KEYWORD)
+      , **dict.fromkeys(_MODIFIERS, Token.MODIFIER)
+      , **dict.fromkeys(_DATA_TYPES, Token.BUILTIN_TYPE)
+      }
 
-    @staticmethod
-    def _categorize_token(tok, prev_token):
-        #print('tok={}'.format(repr(tok)))
-        token = None
-        replace_prev = False
-        # Handle keywords
-        if tok in SimpleCppLexer._KEYWORDS:
-            token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.KEYWORD)
-        # Handle type modifiers
-        elif tok in SimpleCppLexer._MODIFIERS:
-            token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.MODIFIER)
-        # Handle builtin data types
-        elif tok in SimpleCppLexer._DATA_TYPES:
-            token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.BUILTIN_TYPE)
-        # Join scope access to a previous token if latter is identifier
-        elif tok == '::' and prev_token and prev_token.kind == SimpleCppLexer.Token.IDENTIFIER:
-            token = prev_token
-            token.token += tok
-            replace_prev = True
-        elif SimpleCppLexer._NUMBER_RE.match(tok):
-            token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.NUMERIC_LITERAL)
-        elif SimpleCppLexer._IDENTIFIER_RE.match(tok):
-            if prev_token and prev_token.kind == SimpleCppLexer.Token.IDENTIFIER:
-                token = prev_token
-                token.token += tok
-                replace_prev = True
-            elif prev_token and prev_token.kind == SimpleCppLexer.Token.STRING_LITERAL:
-                token = prev_token
-                token.token += tok
-                replace_prev = True
-            else:
-                token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.IDENTIFIER)
-        else:
-            token = SimpleCppLexer.Token(tok, SimpleCppLexer.Token.UNCATEGORIZED)
-        return (token, replace_prev)
+    # NOTE A backslash outside of a string literal "escapes" the next non-word char,
+    # so the latter can't start a literal or a comment.
+    _LEXEM_RE = re.compile(
+        r'(?P<comment>/\*.*?(?:\*/|\Z)|//.*)'
+        r'|(?P<string>"(?:[^"\\]|\\.?)*"?' r"|'(?:[^'\\]|\\.?)*'?)"
+        r'|(?P<word>\w+)'
+        r'|(?P<other>(?:\\\W?|/(?![/*])|[^\w"' r"'/\\])+)"
+      , re.DOTALL
+      )
 
 
     @staticmethod
-    def tokenize_string(snippet):
-        tokens = []
+    def scan(snippet):
+        ''' Split a snippet into tokens w/o creating any objects per token
+
+            Return a tuple of parallel arrays: start and end offsets of tokens
+            in a given snippet and their kinds.
+        '''
+        starts = array.array('I')
+        ends = array.array('I')
+        kinds = array.array('b')
 
         # If first char on a line is '#' -- whole string is a preprocessor
         if snippet.lstrip().startswith('#'):
-            tokens.append(SimpleCppLexer.Token(snippet, SimpleCppLexer.Token.PREPROCESSOR))
-            return tokens
-
-        in_string = False
-        in_block_comment = False
-        in_cpp_comment = False
-        string_char = None
-        #print("tokens={}".format(repr(re.split('(\W+)', snippet))))
-        for tok in re.split('(\W+)', snippet):              # Split the whole snippet by elementary tokens
-            if not tok:                                     # Last item can be empty
-                continue                                    # Just skip it!
-
-            # If we r in a C++ style comment...
-            if in_cpp_comment:
-                # Just merge everything till the end to a previous token
-                assert tokens[-1].kind == SimpleCppLexer.Token.COMMENT
-                tokens[-1].token += tok
-                continue
-
-            # Iterate over tokenized string and look for
-            # quotes (string literals) and comments...
-            last_tokenized_pos = 0
-            seen_slash = False
-            seen_star = False
-            seen_backslash = False
-            want_next = False
-            for pos, c in enumerate(tok):
-                assert not in_cpp_comment
-                if seen_backslash:                          # Go to next char after backclash
-                    seen_backslash = False                  # Ok, backslash was counted...
-                    continue
-                elif in_string:
-                    assert string_char and not seen_slash and not seen_star
-                    # Ok, we r at string now... Check if current char is a quote symbol
-                    # Check if string ends...
-                    if c == string_char:
-                        assert tokens
-                        # Join chars before (including a current) to a prev token
-                        tokens[-1].token += tok[last_tokenized_pos:pos+1]
-                        in_string = False                   # Drop the flag!
-                        last_tokenized_pos = pos + 1
-                    elif c == '\\':
-                        seen_backslash = True
-                elif in_block_comment:
-                    if seen_star and c == '/':              # Is end of block comment?
-                        in_block_comment = False            # Drop the flag!
-                        assert tokens
-                        tokens[-1].token += tok[last_tokenized_pos:pos+1]
-                        last_tokenized_pos = pos + 1
-                    seen_star = bool(c == '*')
-                # Starting a block or C++ style comment?
-                elif seen_slash and (c == '/' or c == '*'):
-                    if c == '/':
-                        in_cpp_comment = True
-                    else:
-                        in_block_comment = True
-                    # Append anything before it as a separate token
-                    before = None
-                    if 0 < (pos - 1):                       # Is this not a token start?
-                        before = tok[last_tokenized_pos:pos-1]
-                    if before:
-                        token, replace_prev = SimpleCppLexer._categorize_token(
-                            before
-                          , tokens[-1] if tokens else None
-                          )
-                        if replace_prev:
-                            tokens[-1] = token
-                        else:
-                            tokens.append(token)
-                    if in_cpp_comment:
-                        comment_start_text = tok[pos-1:]
-                    else:
-                        comment_start_text = tok[pos-1:pos+1]
-                        last_tokenized_pos = pos+1
-                    tokens.append(SimpleCppLexer.Token(comment_start_text, SimpleCppLexer.Token.COMMENT))
-                    if in_cpp_comment:                      # C++ comments do not require further parsing...
-                        want_next = True                    # Order to go for next token after this loop
-                        break                               # immediately!
-                elif c == '"' or c == "'":
-                    in_string = True
-                    string_char = c
-                    # Append anything before it as a separate token
-                    before = None
-                    if 0 < pos:                             # Is this not a token start?
-                        before = tok[last_tokenized_pos:pos]
-                    if before:
-                        token, replace_prev = SimpleCppLexer._categorize_token(
-                            before
-                          , tokens[-1] if tokens else None
-                          )
-                        if replace_prev:
-                            tokens[-1] = token
-                        else:
-                            tokens.append(token)
-                    switch_prev_token =  tokens \
-                      and tokens[-1].kind == SimpleCppLexer.Token.IDENTIFIER \
-                      and tokens[-1].token in SimpleCppLexer._STRING_PREFIXES
-                    if switch_prev_token:
-                        tokens[-1].kind = SimpleCppLexer.Token.STRING_LITERAL
-                        tokens[-1].token += c
-                    else:
-                        tokens.append(SimpleCppLexer.Token(c, SimpleCppLexer.Token.STRING_LITERAL))
-                    last_tokenized_pos = pos+1
-                else:
-                    seen_slash = bool(c == '/')
-                    seen_backslash = bool(c == '\\')
-                    seen_star = bool(c == '*')
-
-            if want_next:                                   # If we are at C++ style comment
-                continue                                    # Go for next tokens immediately
-
-            assert not in_cpp_comment
-            if in_block_comment:
-                assert tokens and tokens[-1].kind == SimpleCppLexer.Token.COMMENT
-                tokens[-1].token += tok[last_tokenized_pos:len(tok)]
-            elif in_string:
-                assert tokens and tokens[-1].kind == SimpleCppLexer.Token.STRING_LITERAL
-                tokens[-1].token += tok[last_tokenized_pos:len(tok)]
-            elif tok[last_tokenized_pos:len(tok)]:
-                token, replace_prev = SimpleCppLexer._categorize_token(
-                    tok[last_tokenized_pos:len(tok)]
-                  , tokens[-1] if tokens else None
-                  )
-                if replace_prev:
-                    assert tokens
-                    tokens[-1] = token
+            starts.append(0)
+            ends.append(len(snippet))
+            kinds.append(SimpleCppLexer.Token.PREPROCESSOR)
+            return (starts, ends, kinds)
+
+        IDENTIFIER = SimpleCppLexer.Token.IDENTIFIER
+        STRING_LITERAL = SimpleCppLexer.Token.STRING_LITERAL
+        prev_kind = None
+        for match in SimpleCppLexer._LEXEM_RE.finditer(snippet):
+            group = match.lastgroup
+            start, end = match.span()
+            if group == 'word':
+                tok = match.group()
+                kind = SimpleCppLexer._WORD_KINDS.get(tok)  # Keywords, modifiers and builtin types
+                if kind is not None:
+                    pass
+                elif tok[0].isdecimal() and SimpleCppLexer._NUMBER_RE.match(tok):
+                    kind = SimpleCppLexer.Token.NUMERIC_LITERAL
+                elif tok[0] in SimpleCppLexer._IDENTIFIER_START:
+                    # Join to a previous identifier or string literal (user defined literal suffix)
+                    if prev_kind == IDENTIFIER or prev_kind == STRING_LITERAL:
+                        ends[-1] = end
+                        continue
+                    kind = IDENTIFIER
                 else:
-                    tokens.append(token)
-        return tokens
+                    kind = SimpleCppLexer.Token.UNCATEGORIZED
+            elif group == 'other':
+                # Join scope access to a previous token if latter is identifier
+                if prev_kind == IDENTIFIER and end - start == 2 and snippet.startswith('::', start):
+                    ends[-1] = end
+                    continue
+                kind = SimpleCppLexer.Token.UNCATEGORIZED
+            elif group == 'string':
+                # Glue a string literal to a prefix (like `u8` or `R`) if any
+                if prev_kind == IDENTIFIER and snippet[starts[-1]:ends[-1]] in SimpleCppLexer._STRING_PREFIXES:
+                    ends[-1] = end
+                    kinds[-1] = prev_kind = STRING_LITERAL
+                    continue
+                kind = STRING_LITERAL
+            else:
+                kind = SimpleCppLexer.Token.COMMENT
+            starts.append(start)
+            ends.append(end)
+            kinds.append(kind)
+            prev_kind = kind
+        return (starts, ends, kinds)
+
+
+    @staticmethod
+    def tokenize_string(snippet):
+        starts, ends, kinds = SimpleCppLexer.scan(snippet)
+        return [
+            SimpleCppLexer.Token(snippet[start:end], kind)
+            for start, end, kind in zip(starts, ends, kinds)
+          ]
 
     @staticmethod
     def assemble_statement(tokens):
@@ -332,11 +245,15 @@ class SimpleCppLexer(object):
 _BOOST_VARIANT_DETAILS_SNTZ_RE = re.compile('(T[0-9_]+)( = boost::detail::variant::void_);( T[0-9_]+\\2;)* (T[0-9_]+)\\2(;)?')
 _BOOST_TAIL_OF_SOME_DETAILS_SNTZ_RE = re.compile('(, (boost::detail::variant::void_|mpl_::na))*>')
 _GENERATED_TEMPLATE_PARAMS_SNTZ_RE = re.compile('((, )?((class|typename) )?(([A-Z][a-z_]*)([0-9]+)))')
-_STD_DEFAULT_ALLOCATORS_SNTZ_RE = re.compile('std::(deque|(forward_)?list|vector)<(.*), std::allocator<\\3>\s*>')
+# NOTE Angle brackets of `operator<` & co and `->` are not brackets at all
+_STD_DEFAULT_ALLOCATORS_SNTZ_RE = re.compile(
+    'std::(deque|forward_list|list|vector)<|(, std::allocator<)|operator(?:<=>|<<=?|>>=?|[<>]=?)|->|[<>]'
+  )
+_RIGHT_ANGLE_BRACKETS_SPACE_SNTZ_RE = re.compile('(?<=>) (?=>)')
 _STD_PLACEHOLDER = 'std::_Placeholder<'
 _STD_PLACEHOLDERS_NS = 'std::placeholders::_'
 _PARAMETER_PACK = ' ...'
-# NOTE Order is important!
+# NOTE Replaced in one pass (the longest match first)
 _BUILTIN_DATA_TYPES_MAPPING = [
     ('long unsigned int', 'unsigned long')
   , ('long int', 'long')
@@ -345,6 +262,10 @@ _BUILTIN_DATA_TYPES_MAPPING = [
   , ('unsigned int', 'unsigned')
   , ('std::basic_string<char>', 'std::string')
   ]
+_BUILTIN_DATA_TYPES_SNTZ_RE = re.compile(
+    '|'.join(re.escape(what) for what, to in sorted(_BUILTIN_DATA_TYPES_MAPPING, key=lambda item: -len(item[0])))
+  )
+_BUILTIN_DATA_TYPES_REPLACEMENTS = dict(_BUILTIN_DATA_TYPES_MAPPING)
 
 
 class SnippetSanitizer(object):
@@ -362,7 +283,7 @@ class SnippetSanitizer(object):
 
 
     def _boost_remove_tail_of_some_details(snippet):
-        return re.sub(_BOOST_TAIL_OF_SOME_DETAILS_SNTZ_RE, '>', snippet)
+        return _BOOST_TAIL_OF_SOME_DETAILS_SNTZ_RE.sub('>', snippet)
 
 
     def _flush_collected_params(stack, start, snippet):
@@ -391,7 +312,7 @@ class SnippetSanitizer(object):
         start = 0
         stack = []
         has_at_least_one_match = False
-        result = ''
+        result = []
         for match in _GENERATED_TEMPLATE_PARAMS_SNTZ_RE.finditer(snippet):
             has_at_least_one_match = True
             # Check if 'flush' required
@@ -406,7 +327,7 @@ class SnippetSanitizer(object):
                 stack.append(match)                         # just append this item
                 continue                                    # and continue w/ a next match
 
-            result += SnippetSanitizer._flush_collected_params(stack, start, snippet)
+            result.append(SnippetSanitizer._flush_collected_params(stack, start, snippet))
 
             start = stack[-1].end()
             stack = [match]
@@ -414,10 +335,10 @@ class SnippetSanitizer(object):
         if not has_at_least_one_match:
             return snippet
 
-        result += SnippetSanitizer._flush_collected_params(stack, start, snippet)
-        result += snippet[stack[-1].end():]
+        result.append(SnippetSanitizer._flush_collected_params(stack, start, snippet))
+        result.append(snippet[stack[-1].end():])
 
-        return result
+        return ''.join(result)
 
 
     def _template_decl_fixer_1(snippet):
@@ -431,58 +352,90 @@ class SnippetSanitizer(object):
         '''Remove a space before '...'
             'class ... Args' to  'class... Args'
         '''
+        result = []
+        start = 0
         idx = snippet.find(_PARAMETER_PACK)
         while idx != -1:
             # Do not remove space function declarations...
             if snippet[idx - 1] != ',':
-                snippet = snippet[:idx] + snippet[idx+1:]
-            idx = snippet.find(_PARAMETER_PACK, idx + len(_PARAMETER_PACK) - 1)
-        return snippet
+                result.append(snippet[start:idx])
+                start = idx + 1
+            idx = snippet.find(_PARAMETER_PACK, idx + len(_PARAMETER_PACK))
+        result.append(snippet[start:])
+        return ''.join(result)
 
 
     def _hide_some_std_details(snippet):
+        result = []
+        start = 0
         idx = snippet.find(_STD_PLACEHOLDER)
         while idx != -1:
             close_pos = snippet.find('>', idx)
-            assert close_pos != -1
-            snippet = snippet[:idx] \
-              + _STD_PLACEHOLDERS_NS \
-              + snippet[idx+len(_STD_PLACEHOLDER):close_pos] \
-              + snippet[close_pos+1:]
-            idx = snippet.find(_STD_PLACEHOLDER, idx + len(_STD_PLACEHOLDERS_NS))
-        return snippet
+            if close_pos == -1:                             # Truncated snippet
+                break
+            result.append(snippet[start:idx])
+            result.append(_STD_PLACEHOLDERS_NS)
+            result.append(snippet[idx+len(_STD_PLACEHOLDER):close_pos])
+            start = close_pos + 1
+            idx = snippet.find(_STD_PLACEHOLDER, start)
+        result.append(snippet[start:])
+        return ''.join(result)
 
 
     def _squeeze_right_angle_brackets(snippet):
         # Squeeze closing angle brackets
-        pos = snippet.find('> >')
-        while pos != -1:
-            snippet = snippet[:pos] + '>>' + snippet[pos+3:]
-            pos = snippet.find('> >', pos + 1)
-        return snippet
+        return _RIGHT_ANGLE_BRACKETS_SPACE_SNTZ_RE.sub('', snippet)
 
 
     def _simplify_some_data_types(snippet):
-        for what, to in _BUILTIN_DATA_TYPES_MAPPING:
-            snippet = snippet.replace(what, to)
-        return snippet
+        return _BUILTIN_DATA_TYPES_SNTZ_RE.sub(lambda match: _BUILTIN_DATA_TYPES_REPLACEMENTS[match.group()], snippet)
 
 
     def _remove_defaulted_params_from_std_types(snippet):
-        result = snippet
-        match = _STD_DEFAULT_ALLOCATORS_SNTZ_RE.search(result)
-        has_at_least_one_match = False
-        while match:
-            assert len(match.groups()) == 3
-            has_at_least_one_match = True
-
-            result = result[0:match.start()] + 'std::' + match.group(1) + '<' + match.group(3) + '>' + result[match.end():]
-            match = _STD_DEFAULT_ALLOCATORS_SNTZ_RE.search(result)
-
-        if not has_at_least_one_match:
-            return snippet
+        '''
+            `std::vector<T, std::allocator<T>>' to `std::vector<T>' (same for lists and deques)
 
-        return result
+            Nested types are handled in one pass: inner types got simplified before
+            the closing bracket of an outer one is seen. Text lengths are compared
+            before texts, so mismatched nested containers don't make it quadratic.
+        '''
+        result = []
+        # Offsets of `result` items in the output text (and the total length as the last one)
+        offsets = [0]
+        # Items are `[is-container, index of the first item inside, index of `, std::allocator<']`
+        stack = []
+        start = 0
+        for match in _STD_DEFAULT_ALLOCATORS_SNTZ_RE.finditer(snippet):
+            text = snippet[start:match.start()]
+            result.append(text)
+            offsets.append(offsets[-1] + len(text))
+            start = match.end()
+            tok = match.group()
+            if tok == '>' and stack:
+                is_container, first, allocator = stack.pop()
+                if is_container and allocator is not None:
+                    value_size = offsets[allocator] - offsets[first]
+                    # NOTE The tail ends w/ `>` of the allocator and the text just appended
+                    tail_size = offsets[-1] - offsets[allocator + 1] - len(text) + len(text.rstrip())
+                    if tail_size == value_size + 1:
+                        value = ''.join(result[first:allocator])
+                        if ''.join(result[allocator + 1:]).rstrip() == value + '>':
+                            del result[first:]
+                            del offsets[first + 1:]
+                            result.append(value)
+                            offsets.append(offsets[-1] + len(value))
+            result.append(tok)
+            offsets.append(offsets[-1] + len(tok))
+            if tok == '>':
+                continue
+            if match.group(2):                              # `, std::allocator<`
+                if stack and stack[-1][0]:
+                    stack[-1][2] = len(result) - 1
+                stack.append([False, len(result), None])
+            elif tok == '<' or match.group(1):
+                stack.append([bool(match.group(1)), len(result), None])
+        result.append(snippet[start:])
+        return ''.join(result)
 
 
     _SANITIZERS = [
@@ -505,11 +458,97 @@ class SnippetSanitizer(object):
         return snippet
 
 
+class CodeTree(object):
+    ''' Hash-consed tree of bracketed groups of a code snippet
+
+        Every node is a tuple of parts: text slices and indices of child nodes.
+        Equal subtrees (e.g. the same `std::vector<...>` repeated over a `[with ...]`
+        list) are stored once, so anything computed per node (like a colorized text)
+        scales w/ a number of unique subtrees instead of the snippet size.
+    '''
+
+    _BRACKETS_RE = re.compile('[<>()]')
+    _CLOSE_CHARS = {'<': '>', '(': ')'}
+
+    def __init__(self):
+        self.nodes = []
+        self.index = {}
+        self.root = None
+
+
+    def _intern(self, parts):
+        parts = tuple(parts)
+        idx = self.index.get(parts)
+        if idx is None:
+            idx = self.index[parts] = len(self.nodes)
+            self.nodes.append(parts)
+        return idx
+
+
+    @staticmethod
+    def parse(snippet):
+        ''' Build a tree for a given snippet or return `None` if brackets are unbalanced '''
+        tree = CodeTree()
+        stack = [[]]
+        close_chars = []
+        start = 0
+        for match in CodeTree._BRACKETS_RE.finditer(snippet):
+            c = match.group()
+            pos = match.start()
+            if c in CodeTree._CLOSE_CHARS:
+                if start < pos:
+                    stack[-1].append(snippet[start:pos])
+                stack.append([])
+                close_chars.append(CodeTree._CLOSE_CHARS[c])
+                start = pos                                 # Open bracket is a part of a child node
+            elif not close_chars or close_chars.pop() != c:
+                return None
+            else:
+                parts = stack.pop()
+                parts.append(snippet[start:pos + 1])
+                stack[-1].append(tree._intern(parts))
+                start = pos + 1
+
+        if close_chars:
+            return None
+        if start < len(snippet):
+            stack[-1].append(snippet[start:])
+        tree.root = tree._intern(stack[-1])
+        return tree
+
+
+    def render(self, render_text):
+        ''' Assemble a snippet back transforming text parts w/ a given function
+
+            Every unique text part is rendered only once. The tree is walked
+            w/o recursion (and w/o joining every subtree), so deeply nested
+            brackets stay linear.
+        '''
+        texts = {}
+        result = []
+        stack = [iter(self.nodes[self.root])]
+        while stack:
+            for part in stack[-1]:
+                if part.__class__ is int:
+                    stack.append(iter(self.nodes[part]))
+                    break
+                text = texts.get(part)
+                if text is None:
+                    text = texts[part] = render_text(part)
+                result.append(text)
+            else:
+                stack.pop()
+        return ''.join(result)
+
+
 RangeItem = collections.namedtuple('RangeItem', ['close_char', 'split_points', 'children'])
+_FORMATTER_SPLIT_CHARS_RE = re.compile('[(),<>]')
 
 class CodeFormatter(object):
 
     TAB_SIZE = 4
+    # NOTE Deeper brackets are left as is: the indentation would take more room than the code
+    MAX_DEPTH = 128
 
     def __init__(self, max_width):
         self.max_width = max_width
@@ -551,121 +590,92 @@ class CodeFormatter(object):
 
 
     def _format_line(self, line):
-
-        #print('\nline="{}"\n'.format(repr(line)))
-
-        prev_char_is_space = False
         ranges = []
         stack = []
 
         # TODO Detect unbalanced brackets?
         # TODO Detect operator<<
-        for i, c in enumerate(line):
-            #print('{}: c={}'.format(i, repr(c)))
-
-            if c == ' ':
-                prev_char_is_space = True
-                continue
+        for match in _FORMATTER_SPLIT_CHARS_RE.finditer(line):
+            c = match.group()
+            i = match.start()
 
-            prev_char_is_space = False
+            if c in '(<' and self.MAX_DEPTH <= len(stack):
+                return [line]                               # Too deep to format
 
-            if c == '(':
+            elif c == '(':
                 stack.append(RangeItem(')', [i + 1], []))
-                #print('{} open={}'.format(repr(i), c))
 
-            elif c == '<' and not prev_char_is_space:
+            elif c == '<':
                 stack.append(RangeItem('>', [i + 1], []))
-                #print('{} open={}'.format(repr(i), c))
 
             elif 0 < len(stack) and c == ',':
                 stack[-1].split_points.append(i)
-                #print('{} comma={}'.format(repr(i), c))
 
             elif 0 < len(stack) and c == stack[-1].close_char:
                 last_item = stack[-1]
                 stack.pop()
                 last_item.split_points.append(i)
-                #print('last_item={}'.format(repr(last_item)))
                 # No need to split anything if range is empty -- i.e. there was nothing between brackets
                 if last_item.split_points[0] != last_item.split_points[-1]:
                     if 0 < len(stack):
                         stack[-1].children.append(last_item)
                     else:
                         ranges.append(last_item)
-                    #print('{} close={}'.format(repr(i), c))
 
         # No way has found to format this line or unbalanced brackets
         if not len(ranges) or len(stack) != 0:
             return [line]
 
         root = RangeItem(None, [0, len(line)], ranges)
-        #print('Ranges after analyze: {}'.format(repr(root)))
-        #print('')
-
-        result = self._tree_walk_and_slice(root, 0, line)
-        #print('result={}'.format(repr(result)))
+        result = []
+        self._tree_walk_and_slice(root, 0, line, result)
         return result
 
 
-    def _tree_walk_and_slice(self, node, level, line):
-        # Is there any split points?
-        if not len(node.split_points):
-            #print('tw{}: {}no split points -- nothing to do'.format(level, _indentation(level, first=True)))
-            return [line]
+    def _tree_walk_and_slice(self, node, level, line, result):
+        ''' Append lines of a given range (split by commas) to the `result`
 
+            Time is linear: children are visited only once (by a cursor moving
+            along w/ slices) and the only recursion is for nested brackets.
+        '''
         # At least 2 split points expected
         assert 1 < len(node.split_points)
 
-
-        # Iterate over slices
-        result = []
+        child_idx = 0
         start = node.split_points[0]
         for pos in node.split_points[1:]:
-            #print('tw{}: {}consider range ({}, {}): "{}"'.format(level, self._indentation(level, first=True), start, pos, line[start:pos]))
-            # Check if current slice can fit into bounds
-            if self.max_width < (pos - start + self._indent_size(level, firstChar=line[start])):
-                # Huh, need to slice current range...
-                #print('tw{}: {}range does not fit: trying subranges'.format(level, self._indentation(level, first=True)))
-                # Is there any child node?
-                if len(node.children):
-                    # Yep, walk through and find a suitable subrange
-                    found = None
-                    found_idx = 0
-                    for found_idx, child in enumerate(node.children):
-                        cstart = child.split_points[0]
-                        for cend in child.split_points[1:]:
-                            if start < cstart and cend < pos:
-                                found = child
-                                #assert (found.level - level) == 1
-                                assert 1 < len(found.split_points)
-                                break
-                        if found is not None:
-                            break
-
-                    if found is not None:
-                        #print('found_idx={}'.format(repr(found_idx)))
-                        #print('tw{}: {}found subrange: {}'.format(level, self._indentation(level, first=True), found))
-                        #print('tw{}: {}append leading subrange ({}, {}): "{}"'.format(level, self._indentation(level, first=True), start, found.split_points[0], line[start:found.split_points[0]]))
-                        result.append(self._indentation(level, first_char=line[start]) + line[start:found.split_points[0]])
-                        result += self._tree_walk_and_slice(found, level + 1, line)
-
-                        #print('tw{}: {}form a trail recursively ({}, {}): "{}"'.format(level, self._indentation(level, first=True), found.split_points[-1], pos, line[found.split_points[-1]:pos]))
-                        new_start = found.split_points[-1]
-                        new_end = pos
-                        new_level = level + 1#int(line[new_start] not in ',>)')
-                        result += self._tree_walk_and_slice(RangeItem(None, [new_start, new_end], node.children[found_idx + 1:]), new_level, line)
-                        #result.append(self._indentation(level + 1, first_char=line[]) + line[found.split_points[-1]:pos])
-                    else:
-                        result.append(self._indentation(level, first_char=line[start]) + line[start:pos])
-                else:
-                    # We can do nothing if there is nothing to split by...
-                    result.append(self._indentation(level, first_char=line[start]) + line[start:pos])
-                    #print('tw{}: {}no children'.format(level, self._indentation(level, first=True)))
-            else:
-                # Yes, it can
-                result.append(self._indentation(level, first_char=line[start]) + line[start:pos])
-                #print('tw{}: {}range fits well'.format(level, self._indentation(level, first=True)))
-
+            child_idx = self._slice(node.children, child_idx, start, pos, level, line, result)
             start = pos
 
-        return result
+
+    def _slice(self, children, child_idx, start, pos, level, line, result):
+        ''' Append lines for a range slice `[start, pos)`
+
+            If the slice doesn't fit, it gets broken at the first nested range:
+            the leading text, lines of the range, and the tail (formatted the same
+            way one level deeper).
+
+            Returns an index of the first child after the slice.
+        '''
+        while True:
+            # Check if current slice can fit into bounds
+            # NOTE The first line indentation is used to check if a slice fits
+            if pos - start + self._indent_size(level, first=True) <= self.max_width:
+                break
+
+            # Skip children of previous slices and find the first nested range
+            while child_idx < len(children) and children[child_idx].split_points[0] <= start:
+                child_idx += 1
+            if child_idx == len(children) or pos <= children[child_idx].split_points[1]:
+                break                                       # We can do nothing if there is nothing to split by...
+
+            found = children[child_idx]
+            child_idx += 1
+            result.append(self._indentation(level, first_char=line[start]) + line[start:found.split_points[0]])
+            self._tree_walk_and_slice(found, level + 1, line, result)
+            # Form a trail
+            start = found.split_points[-1]
+            level += 1
+
+        result.append(self._indentation(level, first_char=line[start]) + line[start:pos])
+        return child_idx
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Optional long-living daemon to keep plugins and configs warm
+
+    A wrapper (e.g. `gcc` symlink) connects to a per-user UNIX socket and
+    passes its STDOUT/STDERR descriptors to the daemon. The daemon forks a
+    worker (w/ all plugins already imported and configs parsed), which decides
+    whether the output needs to be processed at all. If so, the wrapper starts
+    the wrapped executable and hands the read end of its output pipe to the
+    worker (via `SCM_RIGHTS`). The worker writes processed lines directly to
+    the terminal and closes the connection when done.
+
+    If the daemon is not running, the wrapper does everything in-process
+    as usual.
+'''
+
+# Project specific imports
+from . import stats
+from .config import Config
+from .logger import log
+
+# Standard imports
+import array
+import json
+import os
+import pathlib
+import pkgutil
+import select
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+
+
+_SOCKET_ENV = 'OUTPROC_SOCKET'
+_HEADER = struct.Struct('!I')
+_MAX_FDS = 4
+
+
+def socket_path():
+    '''Get a per-user socket path for the daemon'''
+    if _SOCKET_ENV in os.environ:
+        return pathlib.Path(os.environ[_SOCKET_ENV])
+    if 'XDG_RUNTIME_DIR' in os.environ:
+        return pathlib.Path(os.environ['XDG_RUNTIME_DIR']) / 'outproc.sock'
+    return pathlib.Path('/tmp') / 'outproc-{}.sock'.format(os.getuid())
+
+
+def _peer_uid(sock):
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    return uid
+
+
+def _send_message(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8')
+    data = _HEADER.pack(len(data)) + data
+    ancillary = []
+    if fds:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds)))
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed by peer')
+        data += chunk
+    return data
+
+
+def _recv_message(sock):
+    fds = array.array('i')
+    data, ancillary, flags, addr = sock.recvmsg(
+        _HEADER.size
+      , socket.CMSG_LEN(_MAX_FDS * fds.itemsize)
+      )
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - (len(payload) % fds.itemsize)])
+    if not data:
+        raise ConnectionError('Connection closed by peer')
+    data += _recv_exactly(sock, _HEADER.size - len(data))
+    size = _HEADER.unpack(data)[0]
+    return (json.loads(_recv_exactly(sock, size).decode('utf-8')), list(fds))
+
+
+class Client:
+    '''Wrapper side of the daemon protocol'''
+
+    def __init__(self, sock):
+        self.socket = sock
+
+
+    @staticmethod
+    def connect():
+        '''Try to connect to a running daemon. Return `None` if there is no daemon.'''
+        path = socket_path()
+        try:
+            st = path.lstat()
+        except OSError:
+            return None
+        # NOTE Never talk to a daemon of another user (e.g. a socket in `/tmp` created by somebody else)
+        if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(path))
+            if _peer_uid(sock) == os.getuid():
+                return Client(sock)
+        except OSError:
+            pass
+        sock.close()
+        return None
+
+
+    def close(self):
+        self.socket.close()
+
+
+    def request(self, module, binary):
+        '''Ask the daemon if the output of the current command should be processed
+
+            Return a reply dict w/ `action` (`run` or `exec`), `argv`, `env` (variables changed
+            by a plugin), `unset` (variables removed by a plugin), `pty` and `handoff` keys,
+            or `None` if the daemon is unable to serve the request.
+        '''
+        _send_message(
+            self.socket
+          , {
+                'module': module
+              , 'binary': binary
+              , 'argv': sys.argv
+              , 'env': dict(os.environ)
+              , 'cwd': os.getcwd()
+            }
+          , [sys.stdout.fileno(), sys.stderr.fileno()]
+          )
+        reply, fds = _recv_message(self.socket)
+        return reply if reply.get('action') in ('run', 'exec') else None
+
+
+    def attach(self, fd):
+        '''Give the output descriptor of the wrapped executable to the daemon'''
+        _send_message(self.socket, {'action': 'attach'}, [fd])
+
+
+    def wait(self, watcher):
+        ''' Wait until the daemon has finished writing processed output
+
+            When the wrapped executable exits, let the daemon know about it,
+            so it wouldn't wait for descendants holding the output pipe.
+        '''
+        po = select.epoll()
+        po.register(self.socket, select.EPOLLIN)
+        po.register(watcher, select.EPOLLIN)
+        try:
+            while True:
+                for fileno, event in po.poll():
+                    if fileno == watcher.fileno():
+                        if watcher.exited():
+                            po.unregister(watcher)
+                            self.socket.shutdown(socket.SHUT_WR)
+                    elif not self.socket.recv(4096):
+                        return
+        finally:
+            po.close()
+
+
+class _PeerWatcher:
+    '''The wrapper shuts down its side of a connection when the wrapped executable exits'''
+
+    def __init__(self, sock):
+        self.socket = sock
+
+
+    def fileno(self):
+        return self.socket.fileno()
+
+
+    def exited(self):
+        return True
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def _check_peer(self):
+        return _peer_uid(self.request) == os.getuid()
+
+
+    def handle(self):
+        # NOTE Executed in a forked worker process, so it is safe to
+        # replace global state (argv, environment, standard descriptors)
+        if not self._check_peer():
+            return
+
+        request, fds = _recv_message(self.request)
+        if len(fds) != 2:
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(fds[0], sys.stdout.fileno())
+        os.dup2(fds[1], sys.stderr.fileno())
+        for fd in fds:
+            os.close(fd)
+
+        sys.argv = request['argv']
+        os.environ.clear()
+        os.environ.update(request['env'])
+        self.environment = request['env']
+        os.chdir(request['cwd'])
+
+        try:
+            app = self.server.application_factory()
+            app.basename = request['module']
+            app.binary = pathlib.Path(request['binary'])
+            app._load_pp_module()
+
+            if not app.pp_mod.Processor.want_to_handle_current_command():
+                self._reply('exec')
+                return
+
+            config = self.server.get_config(app._config_file_path(app.pp_mod.Processor.config_file_name(app.basename)))
+            processor = app._create_output_processor(config)
+        except:
+            _send_message(self.request, {'action': 'fallback'})
+            return
+
+        self._reply('run', config.get_bool('use-pty', False), app.pp_mod.Processor.handoff)
+        try:
+            message, fds = _recv_message(self.request)
+        except ConnectionError:
+            return                                          # Wrapper has gone away
+        if message.get('action') != 'attach' or len(fds) != 1:
+            return
+
+        with open(fds[0], 'rb') as stream:
+            app._process_output(processor, stream, _PeerWatcher(self.request))
+        sys.stdout.flush()
+        stats.report()
+
+
+    def _reply(self, action, use_pty=False, handoff=False):
+        # NOTE Only changes made by a plugin are sent back
+        _send_message(
+            self.request
+          , {
+                'action': action
+              , 'argv': sys.argv
+              , 'env': {key: value for key, value in os.environ.items() if self.environment.get(key) != value}
+              , 'unset': [key for key in self.environment if key not in os.environ]
+              , 'pty': use_pty
+              , 'handoff': handoff
+            }
+          )
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    '''Fork a warm worker process per wrapper connection'''
+
+    # NOTE A worker lives as long as the wrapped executable it serves,
+    # so there are as many of them as parallel jobs (e.g. `make -j64`)
+    max_children = sys.maxsize
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, path, application_factory):
+        self.application_factory = application_factory
+        self.configs = {}
+        super().__init__(path, _RequestHandler)
+
+
+    def _config_mtime(self, path):
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+
+    def get_config(self, path):
+        '''Get cached configuration data (re-read if file has changed)'''
+        mtime = self._config_mtime(path)
+        cached = self.configs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        config = Config(path)
+        self.configs[path] = (mtime, config)
+        return config
+
+
+    def warm_up(self):
+        '''Import all available plugins and read their configs'''
+        import outproc.pp
+        for importer, name, ispkg in pkgutil.iter_modules(outproc.pp.__path__):
+            if ispkg:
+                continue
+            app = self.application_factory()
+            app.basename = name
+            try:
+                app._load_pp_module()
+                config = self.get_config(app._config_file_path(app.pp_mod.Processor.config_file_name(name)))
+                # Resolve colors requested by the processor and save them right here,
+                # so workers wouldn't do it (and write the same cache file) every time
+                app.pp_mod.Processor(config, name)
+                config.save_cache()
+            except:
+                log.ewarn('Unable to preload module `{}`'.format(name))
+
+
+    def reap_children(self, signum=None, frame=None):
+        '''Collect exited workers (on `SIGCHLD`)'''
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if self.active_children is not None:
+                self.active_children.discard(pid)
+
+
+    def service_actions(self):
+        # NOTE Workers are collected on `SIGCHLD` instead, so the accept loop
+        # never waits for running ones
+        pass
+
+
+    def process_request(self, request, client_address):
+        # Do not let a worker inherit unflushed output of the daemon
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Do not collect a worker before it gets registered as active
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+        try:
+            super().process_request(request, client_address)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+
+
+    def finish_request(self, request, client_address):
+        # NOTE Executed in a worker: processes it starts must be waited as usual
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+        super().finish_request(request, client_address)
+
+
+def serve(application_factory):
+    '''Run the daemon in foreground'''
+    path = socket_path()
+    client = Client.connect()
+    if client is not None:
+        client.close()
+        raise RuntimeError('Daemon is already running ({})'.format(path))
+    if path.exists():
+        path.unlink()                                       # Remove a stale socket
+
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(str(path), application_factory)
+    finally:
+        os.umask(old_umask)
+
+    # Make sure the socket gets removed on `kill`
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGCHLD, server.reap_children)
+
+    try:
+        server.warm_up()
+        log.einfo('Listening on {}'.format(path))
+        sys.stdout.flush()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Entry point of `outproc` and wrappers (symlinks to it)
+
+    NOTE Heavy imports are deferred until it is clear that an output
+    is going to be processed.
+'''
+
+# Project specific imports
+from .manifest import try_exec_wrapped_binary
+
+
+def main():
+    try_exec_wrapped_binary()
+
+    from .cli import main
+    return main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Project specific imports
+from . import stats
+
+# Standard imports
+import collections
+
+
+def _default_sizeof(key, value):
+    return len(key) + len(value)
+
+
+class LRUCache:
+    ''' Size-aware least recently used cache
+
+        When a total size of entries (given by `sizeof(key, value)` function)
+        exceeds the capacity, least recently used entries get evicted.
+        If a `name` is given, hits and misses are counted in `outproc.stats` as well.
+    '''
+
+    def __init__(self, capacity, name=None, sizeof=_default_sizeof):
+        self.capacity = capacity
+        self.sizeof = sizeof
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hits_counter = None if name is None else name + '-cache-hits'
+        self.misses_counter = None if name is None else name + '-cache-misses'
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def get(self, key):
+        ''' Get a cached value or `None` '''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            if self.misses_counter is not None:
+                stats.add(self.misses_counter)
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if self.hits_counter is not None:
+            stats.add(self.hits_counter)
+        return entry[0]
+
+
+    def put(self, key, value):
+        size = self.sizeof(key, value)
+        if self.capacity < size:
+            return                                          # Do not flush whole cache for a huge entry
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self.entries[key] = (value, size)
+        self.size += size
+
+        while self.capacity < self.size:
+            evicted_key, (evicted_value, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
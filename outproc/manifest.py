@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Precomputed manifest of modules to decide a bypass w/o importing them
+
+    Most of the time (e.g. in CI) STDOUT is not a terminal, so the only thing
+    a wrapper has to do is to `exec` the wrapped executable. The manifest describes
+    (for every module) when its `Processor.want_to_handle_current_command()` would
+    definitely refuse to process an output, so that decision doesn't need any
+    plugin (and its heavy dependencies) imported.
+
+    NOTE This module must import nothing but a bare minimum!
+    NOTE Keep the manifest in sync w/ modules (it is checked by unit tests).
+'''
+
+# Project specific imports
+from .resolver import find_wrapped_binary
+
+# Standard imports
+import os
+import sys
+
+
+_FORCE_PROCESSING_ENV = 'OUTPROC_FORCE_PROCESSING'
+
+_GCC = {
+    # Do-Not-Handle options
+    'bypass-options': ['-M', '-MM', '-MG', '-MP', '-MT', '-MQ', '--help']
+}
+
+# Recognized keys:
+#   `bypass-options`    -- the module never handles an output if any of these in a command line
+#   `undecided-options` -- the module has to be imported to make a decision (e.g. it alters a command line)
+#   `tty-only`          -- the module ignores the force processing flag
+MANIFEST = {
+    'c++': _GCC
+  , 'cc': _GCC
+  , 'cmake': {}
+  , 'diff': {'undecided-options': ['--color=always', '--color=no']}
+  , 'g++': _GCC
+  , 'gcc': _GCC
+  , 'make': {'bypass-options': ['menuconfig', 'oldconfig', 'nconfig', 'edit_cache']}
+  , 'mount': {'tty-only': True}
+}
+
+
+def can_bypass(module, argv, isatty, forced):
+    '''Check if a given module definitely would not process an output'''
+    entry = MANIFEST.get(module)
+    if entry is None:
+        return False                                        # Unknown module, so import it to decide
+    if any(option in argv for option in entry.get('undecided-options', [])):
+        return False
+    if any(option in argv for option in entry.get('bypass-options', [])):
+        return True
+    return not isatty and (not forced or entry.get('tty-only', False))
+
+
+def _force_processing_requested():
+    try:
+        return bool(int(os.environ.get(_FORCE_PROCESSING_ENV, '0')))
+    except ValueError:
+        return None
+
+
+def try_exec_wrapped_binary():
+    ''' Replace self w/ a wrapped executable if the output wouldn't be processed anyway
+
+        Return if the decision can't be made here.
+    '''
+    name = os.path.basename(sys.argv[0])
+    real_executable_name = os.path.realpath(sys.argv[0])
+    if name == 'outproc' or os.path.basename(real_executable_name) == name:
+        return                                              # Not a wrapper
+
+    forced = _force_processing_requested()
+    if forced is None or not can_bypass(name, sys.argv, sys.stdout.isatty(), forced):
+        return
+
+    binary = find_wrapped_binary(name, real_executable_name)
+    if binary is not None:
+        os.execv(binary, [binary] + sys.argv[1:])
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+    Markup of a plain line w/ styled spans
+
+    Instead of splicing escape sequences into a line (and re-scanning the
+    result for every next highlight), a plugin attaches `(start, end, style)`
+    spans to the original line, and all of them get rendered in a single join.
+'''
+
+# Standard imports
+import bisect
+
+
+class Markup:
+    ''' Styled spans over a plain line
+
+        Spans may nest or overlap: a span added later is painted over earlier ones.
+        At the end of a span its `restore` sequence gets emitted, or (if it has
+        none) the style of the span underneath, or the `default` one.
+    '''
+
+    def __init__(self, line, default=''):
+        assert isinstance(line, str) and isinstance(default, str)
+        self.line = line
+        self.default = default
+        self.spans = []
+
+
+    def add(self, start, end, style, restore=None):
+        ''' Paint `line[start:end]` w/ a given style (empty spans are ignored) '''
+        assert 0 <= start and end <= len(self.line)
+        if start < end:
+            self.spans.append((start, end, style, restore))
+        return self
+
+
+    def render(self):
+        if not self.spans:
+            return self.line
+
+        # Collect indices of spans closed and opened at every boundary
+        boundaries = {}
+        for idx, (start, end, style, restore) in enumerate(self.spans):
+            boundaries.setdefault(start, ([], []))[1].append(idx)
+            boundaries.setdefault(end, ([], []))[0].append(idx)
+
+        parts = []
+        active = []                                         # Indices of open spans, the topmost is the last
+        last_pos = 0
+        for pos in sorted(boundaries):
+            parts.append(self.line[last_pos:pos])
+            last_pos = pos
+            closing, opening = boundaries[pos]
+            if closing:
+                self._close(closing, active, parts)
+            for idx in opening:
+                self._open(idx, active, parts)
+        parts.append(self.line[last_pos:])
+        return ''.join(parts)
+
+
+    def _open(self, idx, active, parts):
+        at = bisect.bisect(active, idx)
+        active.insert(at, idx)
+        parts.append(self.spans[idx][2])
+        # Spans added later must stay on top
+        parts.extend(self.spans[i][2] for i in active[at + 1:])
+
+
+    def _close(self, closing, active, parts):
+        closing = set(closing)
+        remaining = [idx for idx in active if idx not in closing]
+        if active[:len(remaining)] != remaining:
+            # Crossing spans: start over from the default style
+            parts.append(self.default)
+            parts.extend(self.spans[idx][2] for idx in remaining)
+        else:
+            restore_underlying = False
+            for idx in reversed(active[len(remaining):]):
+                restore = self.spans[idx][3]
+                if restore is None:
+                    restore_underlying = True
+                else:
+                    parts.append(restore)
+            if restore_underlying:
+                parts.append(self.spans[remaining[-1]][2] if remaining else self.default)
+        active[:] = remaining
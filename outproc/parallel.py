@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Ordered parallel processing of independent lines
+
+    Plugins declare (via `Processor.is_independent_line()`) lines which may be
+    processed w/o any sequential state (e.g. a gcc diagnostic message). Such lines
+    are sent to a pool of worker processes, while the rest are processed in-place
+    in order. Results are reassembled in the original order.
+'''
+
+# Project specific imports
+from . import stats
+from .processing import Processor
+
+# Standard imports
+import multiprocessing
+import multiprocessing.util
+
+
+# Number of chunks per worker to split independent lines of a batch into
+_CHUNKS_PER_WORKER = 4
+
+# Output processor instance of a worker process
+_worker_processor = None
+
+
+def _init_worker(processor):
+    global _worker_processor
+    _worker_processor = processor
+    # Let the processor flush its state (e.g. shared caches) when the pool shuts down
+    multiprocessing.util.Finalize(processor, processor.eof, exitpriority=10)
+
+
+def _ping():
+    pass
+
+
+def _handle_chunk(lines):
+    return [_worker_processor.handle_lines([line]) for line in lines]
+
+
+class ParallelProcessor:
+    ''' Wrap a processor to handle independent lines in a pool of worker processes
+
+        NOTE Workers are forked (w/ a copy of the processor) right at construction,
+        so it must be done before any other thread gets started.
+    '''
+
+    def __init__(self, processor, workers):
+        self.processor = processor
+        self.workers = workers
+        self.pool = multiprocessing.get_context('fork').Pool(
+            workers
+          , initializer=_init_worker
+          , initargs=(processor, )
+          )
+        self.pool.apply(_ping)                              # Wait until workers are ready
+
+
+    @staticmethod
+    def supported_by(processor):
+        '''Check if a given processor can tell independent lines'''
+        return type(processor).is_independent_line is not Processor.is_independent_line
+
+
+    def handle_lines(self, lines):
+        # Collect independent lines and remember where to put results
+        slots = []
+        independent = []
+        for line in lines:
+            if self.processor.is_independent_line(line):
+                slots.append(len(independent))
+                independent.append(line)
+            else:
+                slots.append(self.processor.handle_lines([line]))
+
+        if not independent:
+            return [line for result in slots for line in result]
+
+        stats.add('parallel-lines', len(independent))
+        chunk_size = -(-len(independent) // (self.workers * _CHUNKS_PER_WORKER))
+        results = []
+        chunks = [independent[i:i + chunk_size] for i in range(0, len(independent), chunk_size)]
+        for chunk in self.pool.imap(_handle_chunk, chunks):
+            results += chunk
+
+        output = []
+        for slot in slots:
+            output += results[slot] if isinstance(slot, int) else slot
+        return output
+
+
+    def handle_block(self, block):
+        return self.handle_lines(self.processor.line_splitter.split(block))
+
+
+    def eof(self):
+        try:
+            return self.processor.eof()
+        finally:
+            # NOTE Let workers exit normally (unlike `terminate()`), so their finalizers run
+            self.pool.close()
+            self.pool.join()
@@ -18,9 +18,13 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from ..cpp_helpers import CodeFormatter, SimpleCppLexer, SnippetSanitizer
+from .. import __version__, stats
+from ..cpp_helpers import CodeFormatter, CodeTree, SimpleCppLexer, SnippetSanitizer
+from ..lru import LRUCache
+from ..markup import Markup
+from ..shared_cache import make_key, SharedCache
 from ..processing import Processor as ProcessorBase
-from ..term import get_size, get_width, fg2bg, column_formatter, pos_to_offset
+from ..term import get_size, get_width, fg2bg, column_formatter
 
 import collections
 import functools
@@ -29,14 +33,63 @@ import re
 import shlex
 import sys
 import textwrap
+import time
 
 
-_TERM_WIDTH = get_size()[0]
 _LOCATION_RE = re.compile('([^ :]+?):([0-9]+(,|:[0-9]+[:,]?)?)?')
+_NOTICE_MARKERS = [
+    ' In instantiation of'
+  , ' In function'
+  , ' In member function'
+  , ' In lambda function'
+  , ' In static member function '
+  , ' In substitution of '
+  , ' In constructor '
+  , ' In copy constructor '
+  , ' In destructor '
+  , 'In file included from '
+  , '                 from '
+  , '   required from '
+  , '   recursively required from '
+  , '   required by substitution of '
+  , '   recursively required by substitution of '
+  , 'At global scope:'
+  ]
+# Endings of `note:` lines w/ just an informational text
+_NOTE_NOTICE_ENDINGS = (
+    'suggested alternatives:'
+  , 'suggested alternative:'
+  , 'candidate is:'
+  , 'candidates are:'
+  , 'invalid template non-type parameter'
+  , 'template argument deduction/substitution failed:'
+  , ' provided'
+  )
+_NOTICE_RE = re.compile('|'.join(re.escape(marker) for marker in _NOTICE_MARKERS))
 # /tmp/ccUlKMZA.o:zz.cc:function main: error: undefined reference to 'boost::iostreams::zlib::default_strategy'
 _LINK_ERROR_RE = re.compile(':function (vtable for )?(.*): error: ')
-_SKIPPING_WARN = re.compile('\[ skipping [0-9]+ instantiation contexts[^\]]+\]')
+_SKIPPING_WARN = re.compile('\\[ skipping [0-9]+ instantiation contexts[^\\]]+\\]')
+# Message categories in order of precedence
+_LINK_ERROR, _ERROR, _TERMINATED, _WARNING, _SKIPPING, _NOTICE, _PREV_DEFINITION, _NOTE = range(8)
+# Words (separated by spaces) of markers and categories they may indicate
+_MARKER_WORDS = {
+    'error:': (_LINK_ERROR, _ERROR)
+  , 'warning:': (_WARNING, )
+  , 'skipping': (_SKIPPING, )
+  , 'In': (_NOTICE, )
+  , 'from': (_NOTICE, )
+  , 'substitution': (_NOTICE, )
+  , 'global': (_NOTICE, )
+  , 'note:': (_NOTE, )
+  }
+_MARKER_WORDS_SET = frozenset(_MARKER_WORDS)
 _WITH_LIST_START = ' [with '
+# NOTE Colorized tokens never span brackets, unless there are literals,
+# comments or preprocessor directives, so colorizing may go per subtree
+_CONTEXT_SENSITIVE_CODE_RE = re.compile('["\'\\\\#]|/[/*]|::[<(]')
+_CODE_TREE_MIN_SIZE = 512
+_BRACKETS_RE = re.compile('[<>()]')
+_WITH_LIST_CHARS_RE = re.compile('[; \\[\\]]')
 _HELP_LINE = re.compile('^  (?P<option>-\S*)(?:\s+(?P<text>.*)|$)?')
 # Do-Not-Handle options
 _DNH_OPTIONS = ['-M', '-MM', '-MG', '-MP', '-MT', '-MQ', '--help']
@@ -45,6 +98,101 @@ _DNH_OPTIONS = ['-M', '-MM', '-MG', '-MP', '-MT', '-MQ', '--help']
 Range = collections.namedtuple('Range', ['start', 'end'])
 
 
+def _find_marker(line, marker):
+    pos = line.find(marker)
+    return None if pos == -1 else Range(pos, pos + len(marker))
+
+
+def _search_marker(regex, line, group=0):
+    match = regex.search(line)
+    return None if match is None else Range(match.start(group), match.end(group))
+
+
+# Category checkers (in order of precedence). Return a range of a marker found or `None`.
+# NOTE A range of a function name is returned for link errors.
+_CATEGORY_CHECKERS = [
+    lambda line: _search_marker(_LINK_ERROR_RE, line, 2) if ':function ' in line else None
+  , lambda line: _find_marker(line, ' error: ')
+  , lambda line: Range(0, len('compilation terminated.')) if line.startswith('compilation terminated.') else None
+  , lambda line: _find_marker(line, ' warning: ')
+  , lambda line: _search_marker(_SKIPPING_WARN, line)
+  , lambda line: _search_marker(_NOTICE_RE, line)
+  , lambda line: Range(len(line) - len(' previous definition here'), len(line)) if line.endswith(' previous definition here') else None
+  , lambda line: _find_marker(line, ' note: ')
+  ]
+
+
+def _classify(line):
+    ''' Get a category of a compiler message
+
+        Return a tuple of a category (or `None`) and a range of a marker found.
+        Only categories which marker words are present in a line get checked,
+        so a cost of classification doesn't grow w/ a number of markers.
+    '''
+    categories = set()
+    for word in _MARKER_WORDS_SET.intersection(line.split(' ')):
+        categories.update(_MARKER_WORDS[word])
+    if line.startswith('compilation terminated.'):
+        categories.add(_TERMINATED)
+    if line.endswith(' previous definition here'):
+        categories.add(_PREV_DEFINITION)
+
+    for category in sorted(categories):
+        found = _CATEGORY_CHECKERS[category](line)
+        if found is not None:
+            return (category, found)
+    return (None, None)
+
+
+def _bracket_depth_exceeds(snippet, limit):
+    if snippet.count('<') + snippet.count('(') <= limit:
+        return False
+    depth = 0
+    for match in _BRACKETS_RE.finditer(snippet):
+        if match.group() in '<(':
+            depth += 1
+            if limit < depth:
+                return True
+        elif depth:
+            depth -= 1
+    return False
+
+
+def _split_with_list(snippet, start):
+    ''' Get ranges of template arguments of a `[with ...]` list at a given position
+
+        Return a list of ranges and a position after the closing `]`,
+        or `None` if the list is malformed (e.g. a truncated snippet).
+    '''
+    arg_ranges = []
+    last_arg_start = start
+    opened_square_brackets = 0
+    seen_semicolon = False
+    for match in _WITH_LIST_CHARS_RE.finditer(snippet, start):
+        c = match.group()
+        i = match.start()
+        if c == ';':
+            seen_semicolon = True
+        elif c == ' ':
+            if seen_semicolon:
+                if i - 1 <= last_arg_start:                 # Empty argument
+                    return None
+                arg_ranges.append(Range(last_arg_start, i - 1))
+                last_arg_start = i + 1
+                seen_semicolon = False
+        elif seen_semicolon:
+            return None
+        elif c == '[':
+            opened_square_brackets += 1
+        elif opened_square_brackets:
+            opened_square_brackets -= 1
+        else:
+            # Found a closing square bracket! Append last template arg
+            arg_ranges.append(Range(last_arg_start, i))
+            return (arg_ranges, i + 1)
+    return None                                             # Misbalanced brackets
+
+
 class Processor(ProcessorBase):
 
     def __init__(self, config, binary):
@@ -68,65 +216,110 @@ class Processor(ProcessorBase):
         self.enabled_option = config.get_color('enabled-option', 'green+bold')
         self.disabled_option = config.get_color('disabled-option', 'red+bold')
         self.neutral_option = config.get_color('neutral-option', 'white')
+        self.token_colors = {
+            SimpleCppLexer.Token.KEYWORD: self.code_kw
+          , SimpleCppLexer.Token.MODIFIER: self.code_modifier
+          , SimpleCppLexer.Token.BUILTIN_TYPE: self.code_type
+          , SimpleCppLexer.Token.PREPROCESSOR: self.code_preprocessor
+          , SimpleCppLexer.Token.NUMERIC_LITERAL: self.code_number
+          , SimpleCppLexer.Token.STRING_LITERAL: self.code_string
+          , SimpleCppLexer.Token.COMMENT: self.code_comment
+          }
         self.code_cursor = fg2bg(config.get_color('code-cursor', 'red', with_reset=False))
         self.nl = config.get_bool('new-line-after-code', True)
 
-        self.max_code_snippet_length = config.get_int('max-code-snippet-length', int(_TERM_WIDTH * 2 / 3))
+        # NOTE Terminal size is obtained here (not at import time), so a warm
+        # daemon worker would get the size of the terminal it writes to
+        self.max_code_snippet_length = config.get_int('max-code-snippet-length', int(get_size()[0] * 2 / 3))
         self.code_formatter = CodeFormatter(self.max_code_snippet_length)
-
-
-    def _inject_color_at(self, line, color, pos):
-        return line[:pos] + color + line[pos:]
+        # NOTE Budgets to keep worst case latency bounded (e.g. for expression
+        # templates): snippets over the limits are just colored, or even passed
+        # as is, and the rest of a line gets passed as is after a time budget
+        self.max_formatted_snippet_size = config.get_int('max-formatted-snippet-size', 65536)
+        self.max_colored_snippet_size = config.get_int('max-colored-snippet-size', 1048576)
+        self.max_bracket_depth = config.get_int('max-bracket-depth', 128)
+        self.line_time_budget = config.get_int('line-time-budget', 1000) / 1000
+        self.over_budget = False
+        # NOTE Template heavy errors repeat the same (huge) snippets many times
+        self.snippet_cache = LRUCache(
+            config.get_int('code-snippet-cache-size', 4 * 1024 * 1024)
+          , 'snippet'
+          , lambda key, value: len(key[0]) + len(value)
+          )
+        # NOTE Under `make -j` the same diagnostic (e.g. from a header) is
+        # rendered by every compiler process, so share rendered messages
+        shared_cache_size = config.get_int('shared-diagnostic-cache-size', 0)
+        self.diagnostic_cache = None
+        if shared_cache_size:
+            self.diagnostic_cache = SharedCache.in_cache_dir('diagnostics', shared_cache_size)
+            self.diagnostic_cache_key = (__version__, config.cache_key, self.max_code_snippet_length)
 
 
     def _try_colorize_location(self, line, current_color):
         match = _LOCATION_RE.search(line)
         if match:
-            line = self._inject_color_at(
-                self._inject_color_at(line, current_color, match.end())
-              , self.location
-              , match.start()
-              )
+            line = Markup(line, current_color).add(match.start(), match.end(), self.location).render()
         return line
 
 
-    def _colorize_token(self, t, color):
-        return color + t.token + self.code
+    def _handle_code_fragment(self, snippet, color_only):
+        if self.max_colored_snippet_size < len(snippet):
+            stats.add('guard-uncolored-snippets')
+            return snippet
+        if _CODE_TREE_MIN_SIZE <= len(snippet) and not _CONTEXT_SENSITIVE_CODE_RE.search(snippet):
+            tree = CodeTree.parse(snippet)
+            if tree is not None:
+                return tree.render(self._colorize_code)
+        return self._colorize_code(snippet)
+
+
+    def _colorize_code(self, snippet):
+        return self._add_code_spans(Markup(snippet, self.code)).render()
+
+
+    def _add_code_spans(self, markup):
+        snippet = markup.line
+        starts, ends, kinds = SimpleCppLexer.scan(snippet)
+        for start, end, kind in zip(starts, ends, kinds):
+            if kind == SimpleCppLexer.Token.IDENTIFIER:
+                if snippet.startswith(('boost::', 'BOOST_'), start, end):
+                    color = self.code_boost_ns
+                elif snippet.startswith('std::', start, end):
+                    color = self.code_std_ns
+                elif snippet.startswith('m_', start, end):
+                    color = self.code_data_member
+                else:
+                    continue
+            else:
+                color = self.token_colors.get(kind)
+                if color is None:
+                    continue
+            markup.add(start, end, color)
+        return markup
 
 
-    def _handle_code_fragment(self, snippet, color_only):
-        # Tokenize a given snippet
-        tokens = SimpleCppLexer.tokenize_string(snippet)
-        #print('tokens={}'.format(tokens))
-        # Colorize it!
-        for i, tok in enumerate(tokens):
-            if tok.kind == SimpleCppLexer.Token.KEYWORD:
-                tokens[i].token = self._colorize_token(tok, self.code_kw)
-            elif tok.kind == SimpleCppLexer.Token.MODIFIER:
-                tokens[i].token = self._colorize_token(tok, self.code_modifier)
-            elif tok.kind == SimpleCppLexer.Token.BUILTIN_TYPE:
-                tokens[i].token = self._colorize_token(tok, self.code_type)
-            elif tok.kind == SimpleCppLexer.Token.PREPROCESSOR:
-                tokens[i].token = self._colorize_token(tok, self.code_preprocessor)
-            elif tok.kind == SimpleCppLexer.Token.NUMERIC_LITERAL:
-                tokens[i].token = self._colorize_token(tok, self.code_number)
-            elif tok.kind == SimpleCppLexer.Token.STRING_LITERAL:
-                tokens[i].token = self._colorize_token(tok, self.code_string)
-            elif tok.kind == SimpleCppLexer.Token.COMMENT:
-                tokens[i].token = self._colorize_token(tok, self.code_comment)
-            elif tok.kind == SimpleCppLexer.Token.IDENTIFIER:
-                if tok.token.startswith('boost::') or tok.token.startswith('BOOST_'):
-                    tokens[i].token = self._colorize_token(tok, self.code_boost_ns)
-                elif tok.token.startswith('std::'):
-                    tokens[i].token = self._colorize_token(tok, self.code_std_ns)
-                elif tok.token.startswith('m_'):
-                    tokens[i].token = self._colorize_token(tok, self.code_data_member)
-        # Reassemble the code snippet
-        snippet = SimpleCppLexer.assemble_statement(tokens)
-        return snippet
+    def _too_complex_to_format(self, snippet):
+        if self.max_formatted_snippet_size < len(snippet):
+            stats.add('guard-snippet-size')
+            return True
+        if _bracket_depth_exceeds(snippet, self.max_bracket_depth):
+            stats.add('guard-bracket-depth')
+            return True
+        return False
 
 
     def _handle_code_snippet(self, snippet, current_color, color_only):
+        if not color_only and self._too_complex_to_format(snippet):
+            color_only = True
+        key = (snippet, current_color, color_only, self.max_code_snippet_length)
+        result = self.snippet_cache.get(key)
+        if result is None:
+            result = self._render_code_snippet(snippet, current_color, color_only)
+            self.snippet_cache.put(key, result)
+        return result
+
+
+    def _render_code_snippet(self, snippet, current_color, color_only):
         if not color_only:
             # Try to sanitize whole fragment before doing anything else...
             snippet = SnippetSanitizer.cleanup_snippet(snippet)
@@ -145,6 +338,15 @@ class Processor(ProcessorBase):
         last_leading_pos = 0
         # There are few '[with ' possible in one message
         while pos != -1:
+            # Find corresponding close ']'... and get a list of ranges of template args
+            with_list = _split_with_list(snippet, pos + len(_WITH_LIST_START))
+            if with_list is None:
+                # Nothing to expand, so the rest goes as an ordinal fragment
+                return result + self.code \
+                    + self._handle_code_fragment(snippet[last_leading_pos:], color_only) \
+                    + current_color
+            arg_ranges, end = with_list
+
             # Copy everything before '[with' (if anything present)
             if last_leading_pos != pos:
                 result += self.code \
@@ -152,39 +354,7 @@ class Processor(ProcessorBase):
                     + current_color + '\n[ with\n'
             else:
                 result += current_color + '\n[ with\n'
-
-            # Find corresponding close ']'... and get a list of ranges of template args
-            arg_ranges = []
-            with_start_pos = pos + len(_WITH_LIST_START)
-            last_arg_start = with_start_pos
-            opened_square_brackets = 0
-            seen_semicolon = False
-            for i, c in enumerate(snippet[last_arg_start:]):
-                if c == ';':
-                    seen_semicolon = True
-                elif c == ' ' and seen_semicolon:
-                    assert last_arg_start < with_start_pos + i - 1
-                    arg_ranges.append(Range(last_arg_start, with_start_pos + i - 1))
-                    last_arg_start = with_start_pos + i + 1
-                    seen_semicolon = False
-                elif c == '[':
-                    opened_square_brackets += 1
-                    assert not seen_semicolon
-                elif c == ']':
-                    assert not seen_semicolon
-                    if not opened_square_brackets:
-                        # Found a closing square bracket!
-                        # Append last template arg
-                        arg_ranges.append(Range(last_arg_start, with_start_pos + i))
-                        assert pos < with_start_pos + i
-                        pos = with_start_pos + i + 1
-                        break
-                    else:
-                        opened_square_brackets -= 1
-
-            # Check invariant
-            assert not opened_square_brackets, 'Misbalanced brackets?'
-            assert arg_ranges, 'Template argument ranges expected to be non empty'
+            pos = end
 
             # Iterate over found template parameters
             for r in arg_ranges:
@@ -209,9 +379,15 @@ class Processor(ProcessorBase):
         # The line definitely has some code snippets!
         is_code_fragment = False
         fragments = []
+        deadline = time.monotonic() + self.line_time_budget
         for fragment in line.split("'"):
-            if is_code_fragment:
+            if not is_code_fragment:
+                pass
+            elif not self.line_time_budget or time.monotonic() < deadline:
                 fragment = self._handle_code_snippet(fragment, current_color, False)
+            else:
+                stats.add('guard-line-time-budget')
+                self.over_budget = True
             is_code_fragment = not is_code_fragment
             fragments.append(fragment)
         return "'".join(fragments)
@@ -253,8 +429,7 @@ class Processor(ProcessorBase):
     def _handle_notice(self, line):
         line = self._try_colorize_location(line, self.notice)
         line = self._try_line_with_quoted_code(line, self.notice)
-        line = self._inject_color_at(line, self.notice, 0)
-        return line + self.config.color.reset
+        return self.notice + line + self.config.color.reset
 
 
     def _handle_notice_with_code(self, line, code_start_pos):
@@ -274,49 +449,41 @@ class Processor(ProcessorBase):
         line = line.replace("couldn't", "could not")
 
         # Categorize message first...
+        category, found = _classify(line)
+
+        # NOTE Only messages w/ quoted code are worth to share (others are cheap to render)
+        if category is None or self.diagnostic_cache is None or "'" not in line:
+            return self._handle_message(line, category, found)
+
+        key = make_key(line, *self.diagnostic_cache_key)
+        result = self.diagnostic_cache.get(key)
+        if result is None:
+            self.over_budget = False
+            result = self._handle_message(line, category, found)
+            if not self.over_budget:                        # Do not share a partially rendered message
+                self.diagnostic_cache.put(key, result)
+        return result
 
+
+    def _handle_message(self, line, category, found):
         # Trying various error messages
-        match = _LINK_ERROR_RE.search(line)
-        if match:
-            return self._handle_link_error(line, match.group(2))
-        idx = line.find(' error: ')
-        if idx != -1:
-            return self._handle_error(line, idx)
-        if line.startswith('compilation terminated.'):
+        if category == _LINK_ERROR:
+            return self._handle_link_error(line, line[found.start:found.end])
+        if category == _ERROR:
+            return self._handle_error(line, found.start)
+        if category == _TERMINATED:
             return self.error + line + self.config.color.reset
 
         # Trying some warning messages
-        idx = line.find(' warning: ')
-        if idx != -1:
-            return self._handle_warning(line, idx)
-
-        # Mark "[ skipping N instantiation contexts, use -ftemplate-backtrace-limit=0 to disable ]"
+        # NOTE Mark "[ skipping N instantiation contexts, use -ftemplate-backtrace-limit=0 to disable ]"
         # as warning, so it will be noticeable
-        match = _SKIPPING_WARN.search(line)
-        if match:
-            return self._handle_warning(line, match.start())
-
-        # TODO Transform into a container of strings and a predicate evaluation
-        is_look_like_notice = line.find(' In instantiation of') != -1 \
-          or line.find(' In function') != -1                          \
-          or line.find(' In member function') != -1                   \
-          or line.find(' In lambda function') != -1                   \
-          or line.find(' In static member function ') != -1           \
-          or line.find(' In substitution of ') != -1                  \
-          or line.find(' In constructor ') != -1                      \
-          or line.find(' In copy constructor ') != -1                 \
-          or line.find(' In destructor ') != -1                       \
-          or line.find('In file included from ') != -1                \
-          or line.find('                 from ') != -1                \
-          or line.find('   required from ') != -1                     \
-          or line.find('   recursively required from ') != -1         \
-          or line.find('   required by substitution of ') != -1       \
-          or line.find('   recursively required by substitution of ') != -1 \
-          or line.find('At global scope:') != -1
-        if is_look_like_notice:
+        if category == _WARNING or category == _SKIPPING:
+            return self._handle_warning(line, found.start)
+
+        if category == _NOTICE:
             return self._handle_notice(line)
         # Handle link notice
-        if line.endswith(' previous definition here'):
+        if category == _PREV_DEFINITION:
             return self._handle_link_notice(line)
 
         # There are possible a bunch of messages started w/ 'note:'
@@ -324,20 +491,12 @@ class Processor(ProcessorBase):
         # may contain code (in single quotes) mixed w/ text, or just pure code line...
         # I see no other reliable way to recognize code (when it is not in a quotes)
         # than this:
-        note_index = line.find(' note: ')
-        if note_index != -1:
-            is_look_like_notice = line.endswith('suggested alternatives:')         \
-              or line.endswith('suggested alternative:')                           \
-              or line.endswith('candidate is:')                                    \
-              or line.endswith('candidates are:')                                  \
-              or line.endswith('invalid template non-type parameter')              \
-              or line.endswith('template argument deduction/substitution failed:') \
-              or line.endswith(' provided')
-            if is_look_like_notice:
+        if category == _NOTE:
+            if line.endswith(_NOTE_NOTICE_ENDINGS):
                 return self._handle_notice(line)
             cnt = line.count("'")
             if not cnt or cnt % 2:
-                return self._handle_notice_with_code(line, note_index + len(' note: '))
+                return self._handle_notice_with_code(line, found.end)
             return self._handle_notice(line)
 
         # All standalong code snippets (AFAIK) starts w/ at least one space...
@@ -358,16 +517,15 @@ class Processor(ProcessorBase):
         # #include <iostreamz>
         #                     ^
         if len(self.prev_line) <= pos:
-            # Append spaces to it! So pos_to_offset() will find a requested
-            # position after line gets colorized...
+            # Append spaces to it! So the cursor would be visible...
             self.prev_line += ' ' * (pos - len(self.prev_line) + 1)
-        line = self.code + self._handle_code_fragment(self.prev_line, True) + self.config.color.reset
-
-        # Find a cursor position for a transformed line
-        pos = pos_to_offset(line, pos)
-        line = line[:pos] + \
-          self.code_cursor + line[pos:pos+1] + self.config.color.normal_bg \
-          + line[pos+1:] + ('\n' if self.nl else '')
+        markup = Markup(self.prev_line, self.code)
+        if self.max_colored_snippet_size < len(self.prev_line):
+            stats.add('guard-uncolored-snippets')
+        else:
+            self._add_code_spans(markup)
+        markup.add(pos, pos + 1, self.code_cursor, self.config.color.normal_bg)
+        line = self.code + markup.render() + self.config.color.reset + ('\n' if self.nl else '')
         self.prev_line = None
 
         # Return unmodified line if nothing has matched
@@ -456,6 +614,25 @@ class Processor(ProcessorBase):
         return lines + self.tail_lines
 
 
+    def eof(self):
+        result = super().eof()
+        if self.diagnostic_cache is not None:
+            self.diagnostic_cache.flush()
+        return result
+
+
+    def looks_like_diagnostic(self, line):
+        '''Check if a given line is a compiler message (i.e. not a code snippet or a caret line)'''
+        return _classify(line)[0] is not None
+
+
+    def is_independent_line(self, line):
+        # NOTE Diagnostic messages are handled before (and w/o touching)
+        # code snippets and carets, which depend on `prev_line`
+        return self.handle_line == self._handle_compile_line \
+          and (' error: ' in line or ' warning: ' in line or ' note: ' in line)
+
+
     def handle_line(self, line):
         # Check if '--help=<smth>' was called,
         # then the very first line will contains this text:
@@ -18,8 +18,11 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from ..processing import Processor as ProcessorBase, force_processing, force_processing_requested
+from ..config import Config
+from ..markup import Markup
+from ..processing import Processor as ProcessorBase, find_config_file, force_processing, force_processing_requested
 from .cmake import Processor as CMakeProcessor
+from .gcc import Processor as GccProcessor
 
 import os
 import re
@@ -27,7 +30,7 @@ import shlex
 import sys
 
 
-_KNOWN_COMPILERS = ['c++', 'g++', 'gcc']
+_KNOWN_COMPILERS = ['c++', 'g++', 'gcc', 'cc', 'clang', 'clang++', 'ccache', 'distcc']
 
 _MAKE_MGS_RE = re.compile('make(\[[0-9]+\])?: ')
 _MAKE_ERROR_MSG_RE = re.compile('make(\[[0-9]+\])?: \*\*\*')
@@ -36,6 +39,9 @@ _MAKE_MISC_PATH_RE = re.compile('.*(`.*\').*')
 
 class Processor(ProcessorBase):
 
+    # Nested `gcc` wrappers mark diagnostics they have processed
+    handoff = True
+
     @staticmethod
     def want_to_handle_current_command():
         # Try to handle an output if:
@@ -65,6 +71,24 @@ class Processor(ProcessorBase):
         self.warning = config.get_color('compiler-option-W', 'yellow+bold')
         self.lib_paths = config.get_color('compiler-option-L', 'green')
         self.cmake_processor = CMakeProcessor(config, binary)
+        self.known_compilers = frozenset(config.get_string('known-compilers', ' '.join(_KNOWN_COMPILERS)).split())
+        # NOTE A compiler name (w/ quotes removed by `shlex`) may be preceded by
+        # a path separator or a space, so lines w/o such words are not even tokenized
+        self.compiler_name_re = re.compile(
+            '(?:^|[\\s/\'"])(?:{})(?:[\\s\'"]|$)'.format('|'.join(re.escape(name) for name in self.known_compilers))
+          )
+        # Results of `stat()` for compiler and directory paths
+        self.compiler_paths = {}
+        self.directories = {}
+        # NOTE Compiler diagnostics get processed here, so compilers don't need to be wrapped
+        self.gcc_processor = None
+        if config.get_bool('handle-gcc-diagnostics', True):
+            gcc_config = Config(find_config_file(GccProcessor.config_file_name('gcc')))
+            self.gcc_processor = GccProcessor(gcc_config, 'gcc')
+            gcc_config.save_cache()                         # Remember colors requested by the processor
+        # Code snippet (following a diagnostic) waiting for a caret line
+        self.pending_snippet = None
+        self.after_diagnostic = False
 
 
     def _detect_make_message(self, line):
@@ -79,6 +103,22 @@ class Processor(ProcessorBase):
         return self.misc + line + self.config.color.reset
 
 
+    def _is_compiler(self, arg):
+        if os.path.basename(arg) not in self.known_compilers:
+            return False
+        result = self.compiler_paths.get(arg)
+        if result is None:
+            result = self.compiler_paths[arg] = os.path.isfile(arg)
+        return result
+
+
+    def _is_directory(self, arg):
+        result = self.directories.get(arg)
+        if result is None:
+            result = self.directories[arg] = os.path.isdir(arg)
+        return result
+
+
     def _is_look_like_cmake_compile(self, line):
         ''' Try to parse possible cmake compile command line...
             maybe we can higlight gcc options?
@@ -89,6 +129,8 @@ class Processor(ProcessorBase):
             This function will try to detect first 3 tokens, and if everything
             is found, the 4th assumed to be a compiler executable name...
         '''
+        if not self.compiler_name_re.search(line):
+            return (False, [], 0)
         score = 0
         args = None
         try:
@@ -102,13 +144,13 @@ class Processor(ProcessorBase):
                 return (True, args, i)
             elif score == 0 and arg == 'cd' or arg == '\x1b[0mcd':
                 score += 1
-            if score == 0 and os.path.isfile(arg) and os.path.basename(arg) in _KNOWN_COMPILERS:
+            if score == 0 and self._is_compiler(arg):
                 score += 4
-            elif score == 1 and os.path.isdir(arg):
+            elif score == 1 and self._is_directory(arg):
                 score += 1
             elif score == 2 and arg == '&&':
                 score += 1
-            elif score == 3 and os.path.isfile(arg) and os.path.basename(arg) in _KNOWN_COMPILERS:
+            elif score == 3 and self._is_compiler(arg):
                 score += 1
             i += 1
         return (False, args, i)
@@ -133,25 +175,66 @@ class Processor(ProcessorBase):
         return (None, False)
 
 
-    def _colorize_option(self, option, color, line, last_find_idx):
-        assert isinstance(option, str) and isinstance(color, str) and isinstance(line, str) and isinstance(last_find_idx, int)
+    def _colorize_option(self, option, color, markup, last_find_idx):
+        assert isinstance(option, str) and isinstance(color, str) and isinstance(last_find_idx, int)
 
         # Find corresponding option at raw line
-        pos = line.find(option, last_find_idx)
+        pos = markup.line.find(option, last_find_idx)
         assert pos != -1
         # Colorise it
-        line = line[:pos] + color + line[pos:pos+len(option)] + self.config.color.reset + line[pos+len(option):]
-        last_find_idx = pos + len(color) + len(self.config.color.reset)
-        return (line, last_find_idx)
+        markup.add(pos, pos + len(option), color)
+        return pos + len(option)
+
+
+    def is_independent_line(self, line):
+        # Compiler command lines (produced by CMake) are not make/cmake messages
+        # NOTE A held code snippet must be output before the next line, and
+        # the next line after a diagnostic could be its code snippet
+        return line.startswith('cd ') and ' && ' in line \
+          and self.pending_snippet is None and not self.after_diagnostic
+
+
+    def _handle_gcc_line(self, line):
+        ''' Route compiler diagnostics (w/ code snippets and carets) to the `gcc` processor
+
+            Return `False` if the line is not a part of a diagnostic.
+
+            A code snippet is held until the next line. Only if it's a caret line,
+            both are given to the `gcc` processor (which would hide a snippet
+            otherwise), so a snippet can't get lost (e.g. under `make -j`).
+        '''
+        if self.pending_snippet is not None:
+            snippet = self.pending_snippet
+            self.pending_snippet = None
+            if line.startswith(' ') and '^' in line:
+                self.gcc_processor.handle_line(snippet)
+                return self.gcc_processor.handle_line(line)
+            line = self.handle_line(line)
+            return snippet if line is None else snippet + '\n' + line
+
+        if not _MAKE_MGS_RE.match(line) and self.gcc_processor.looks_like_diagnostic(line):
+            self.after_diagnostic = True
+            return self.gcc_processor.handle_line(line)
+
+        if self.after_diagnostic and line.startswith(' ') and line.strip():
+            self.pending_snippet = line
+            return None
+
+        self.after_diagnostic = False
+        return False
 
 
     def handle_line(self, line):
+        if self.gcc_processor is not None:
+            result = self._handle_gcc_line(line)
+            if result is not False:
+                return result
+
         is_make_message, is_error_message = self._detect_make_message(line)
         if is_make_message:
-            line = self.misc + line
+            markup = Markup(line, self.config.color.reset).add(0, len(line), self.misc)
             if is_error_message:
-                stars_idx = line.index('***')
-                line = line[:stars_idx] + self.error + line[stars_idx:]
+                markup.add(line.index('***'), len(line), self.error)
             else:
                 # Highlight path enclosed in `'
                 pos = line.find('`')
@@ -159,8 +242,8 @@ class Processor(ProcessorBase):
                     close_pos = line.index("'")
                     assert close_pos != -1
                     close_pos += 1
-                    line = line[:pos] + self.misc_path + line[pos:close_pos] + self.misc + line[close_pos:]
-            line += self.config.color.reset
+                    markup.add(pos, close_pos, self.misc_path)
+            line = markup.render()
         # Lines started w/ '/usr/bin/make' paint w/ `misc' color
         elif line.startswith(self.binary):
             return self._colorize_with_misc(line)
@@ -176,14 +259,26 @@ class Processor(ProcessorBase):
             option_color = None
             paint_next_arg = False
             if is_compiler_cmd_line:
+                markup = Markup(line, self.config.color.reset)
                 for i in range(first_compiler_option_idx, len(args)):
                     if paint_next_arg:
-                        line, last_find_idx = self._colorize_option(args[i], option_color, line, last_find_idx)
+                        last_find_idx = self._colorize_option(args[i], option_color, markup, last_find_idx)
                         paint_next_arg = False
                         continue
                     # Try to get color for current option
                     option_color, paint_next_arg = self._try_get_color_for_option(args[i])
                     if option_color is not None:
-                        line, last_find_idx = self._colorize_option(args[i], option_color, line, last_find_idx)
+                        last_find_idx = self._colorize_option(args[i], option_color, markup, last_find_idx)
+                line = markup.render()
 
         return line
+
+
+    def eof(self):
+        result = super().eof() or []
+        if self.pending_snippet is not None:
+            result.append(self.pending_snippet)
+            self.pending_snippet = None
+        if self.gcc_processor is not None:
+            self.gcc_processor.eof()
+        return result
@@ -18,11 +18,14 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Project specific imports
-from .config import Config
+from . import stats
 from .logger import log
 
 # Standard imports
+import fcntl
 import os
+import pathlib
+import signal
 import sys
 import traceback
 
@@ -30,26 +33,139 @@ import traceback
 SYSCONFDIR = '/etc/outproc'
 
 _FORCE_PROCESSING_ENV = 'OUTPROC_FORCE_PROCESSING'
+_HANDOFF_ENV = 'OUTPROC_HANDOFF'
+# NOTE It is an APC sequence, so terminals would ignore it if it ever leaks
+HANDOFF_MARKER = '\x1b_outproc\x1b\\'
+
+
+class LineSplitter:
+    ''' Split a stream of blocks into decoded lines
+
+        Every block is scanned and decoded only once. Only a trailing
+        (incomplete) line is kept between calls.
+    '''
+
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self.tail = bytearray()
+
+
+    def split(self, block):
+        ''' Get a list of complete lines (w/o line delimiters) from a given block '''
+        end = block.rfind(b'\n')
+        if end == -1:                                       # No complete lines yet?
+            self.tail += block                              # Just collect the data
+            return []
+
+        view = memoryview(block)
+        if self.tail:
+            # Complete a line started in a previous block
+            start = block.find(b'\n')
+            self.tail += view[:start]
+            lines = [self.tail.decode(self.encoding)]
+            if start != end:
+                lines += str(view[start + 1:end], self.encoding).split('\n')
+        else:
+            lines = str(view[:end], self.encoding).split('\n')
+
+        self.tail = bytearray(view[end + 1:])               # Keep the reminder for next time
+        return lines
+
+
+    def flush(self):
+        ''' Get (and forget) an incomplete line collected so far '''
+        tail = self.tail.decode(self.encoding)
+        self.tail = bytearray()
+        return tail
+
+
+class ChildWatcher:
+    ''' Make an exit of a child process observable via a file descriptor
+
+        Use `pidfd` if available, otherwise fallback to a self-pipe
+        written on `SIGCHLD` arrival.
+    '''
+
+    def __init__(self, process):
+        self.process = process
+        self.wakeup_fd = None
+        self.fd = None
+
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self.fd = os.pidfd_open(process.pid)
+            except OSError:
+                pass                                        # E.g. a kernel is too old
+
+        if self.fd is None:
+            self.fd, self.wakeup_fd = os.pipe()
+            for fd in (self.fd, self.wakeup_fd):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            # NOTE The handler does nothing, but a signal arrival will wake up a poll loop
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            signal.set_wakeup_fd(self.wakeup_fd)
+            # The child could exit before the handler has been set
+            if self.process.poll() is not None:
+                os.write(self.wakeup_fd, b'\0')
+
+
+    def fileno(self):
+        return self.fd
+
+
+    def exited(self):
+        ''' Check if the child has exited (should be called when the descriptor is readable) '''
+        if self.wakeup_fd is None:
+            return True
+        try:
+            while os.read(self.fd, 64):                     # Drain wakeup notifications
+                pass
+        except BlockingIOError:
+            pass
+        return self.process.poll() is not None
+
+
+    def close(self):
+        if self.wakeup_fd is not None:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.close(self.wakeup_fd)
+        os.close(self.fd)
 
 
 class Processor:
 
+    # Let nested wrappers (e.g. `gcc` run by `make`) mark lines they have processed,
+    # so they are passed through as is (see `handoff_environment()`)
+    handoff = False
+
     def __init__(self, config, binary):
         self.config = config
         self.binary = binary
-        self.read_buffer = b''
+        self.line_splitter = LineSplitter()
 
 
     def handle_line(self, line):
         return line
 
 
-    def handle_block(self, block):
-        self.read_buffer += block                           # Append just read block to a storage
-        pos = self.read_buffer.find(b'\n')                  # Try to find a line delimiter
-        lines = []
-        while pos != -1:                                    # Found?
-            line = self.read_buffer[:pos].decode('utf-8')
+    def is_independent_line(self, line):
+        ''' Check if a given line can be processed w/o (and w/o affecting) any sequential state
+
+            Such lines can be processed in parallel (see `parallel-workers` config option).
+        '''
+        return False
+
+
+    def handle_lines(self, lines):
+        ''' Process a batch of complete lines. Return a list of lines to output. '''
+        result = []
+        final_lines = 0
+        for line in lines:
+            if line.startswith(HANDOFF_MARKER):             # Already processed by a nested wrapper
+                result.append(line[len(HANDOFF_MARKER):])
+                final_lines += 1
+                continue
             try:
                 line = self.handle_line(line)
             except:
@@ -57,16 +173,21 @@ class Processor:
                     'Post-process module ({}) failure'.format(os.path.basename(self.binary))
                     )
             if line is not None:                            # Ignore/hide the line if line handler returns None
-                lines.append(line)
-            pos += 1                                        # Remove '\n' from the input
-            self.read_buffer = self.read_buffer[pos:]       # Cut just processed line
-            pos = self.read_buffer.find(b'\n')              # Is there some more line remain?
-        return lines
+                result.append(line)
+        if final_lines:
+            stats.add('handoff-lines', final_lines)
+        return result
+
+
+    def handle_block(self, block):
+        return self.handle_lines(self.line_splitter.split(block))
 
 
     def eof(self):
-        if self.read_buffer:
-            return [self.handle_line(self.read_buffer.decode('utf-8'))]
+        tail = self.line_splitter.flush()
+        if tail:
+            # NOTE An incomplete last line is handled as a complete one
+            return self.handle_lines([tail])
 
 
     @staticmethod
@@ -79,6 +200,18 @@ class Processor:
         return sys.stdout.isatty() or force_processing_requested()
 
 
+def find_config_file(config_file_name):
+    '''Get a path to a given config file: a user's one if exists, otherwise a system-wide'''
+    # Try user config file first
+    if 'HOME' in os.environ:
+        config_file_name_full = pathlib.Path.home() / '.outproc' / config_file_name
+        if config_file_name_full.exists():
+            return config_file_name_full
+
+    # If no user config, then will try a system-wide
+    return pathlib.Path(SYSCONFDIR) / config_file_name
+
+
 def force_processing():
     os.environ[_FORCE_PROCESSING_ENV] = '1'
 
@@ -88,6 +221,32 @@ def force_processing_requested():
     return _FORCE_PROCESSING_ENV in os.environ and int(os.environ[_FORCE_PROCESSING_ENV])
 
 
+def _file_id(fd):
+    st = os.fstat(fd)
+    return '{}:{}'.format(st.st_dev, st.st_ino)
+
+
+def handoff_environment(fd):
+    ''' Get an environment for a child process writing to a given descriptor
+
+        Nested instances writing to the descriptor would mark processed lines
+        w/ `HANDOFF_MARKER`, so this instance doesn't need to process them again.
+    '''
+    env = dict(os.environ)
+    env[_HANDOFF_ENV] = _file_id(fd)
+    return env
+
+
+def handoff_requested():
+    '''Check if STDOUT is read by an outer instance expecting processed lines to be marked'''
+    if _HANDOFF_ENV not in os.environ:
+        return False
+    try:
+        return _file_id(sys.stdout.fileno()) == os.environ[_HANDOFF_ENV]
+    except (OSError, ValueError):
+        return False                                        # E.g. STDOUT is closed
+
+
 def report_error_with_backtrace(intro_message):
     exc_type, exc_value, exc_traceback = sys.exc_info()
     log.eerror(
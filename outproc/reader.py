@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Decoupled reader of a wrapped executable output
+
+    A reader thread drains the child's output as fast as it can into a bounded
+    in-memory buffer, so the (possibly slow) processing never makes the child
+    block on `write()` while the buffer has room.
+'''
+
+# Project specific imports
+from . import stats
+
+# Standard imports
+import collections
+import errno
+import fcntl
+import os
+import select
+import threading
+import time
+
+
+# Size of a block to read from a wrapped executable
+READ_BLOCK_SIZE = 64 * 1024
+# Max amount of unprocessed output to keep in memory
+BACKLOG_CAPACITY = 64 * 1024 * 1024
+# Desired capacity of an output pipe of a wrapped executable
+PIPE_SIZE = 1024 * 1024
+# How long (in seconds) to wait for the rest of output after a wrapped executable has exited
+_EXIT_GRACE_PERIOD = 0.05
+# NOTE Available in `fcntl` since Python 3.10 only
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def enlarge_pipe(fd, size=PIPE_SIZE):
+    '''Try to enlarge a pipe buffer. Return the actual size or `None` if not a pipe.'''
+    try:
+        return fcntl.fcntl(fd, _F_SETPIPE_SZ, size)
+    except OSError:
+        pass
+    # NOTE Unprivileged users can't exceed `/proc/sys/fs/pipe-max-size`
+    try:
+        with open('/proc/sys/fs/pipe-max-size') as f:
+            limit = int(f.read())
+        if limit < size:
+            return fcntl.fcntl(fd, _F_SETPIPE_SZ, limit)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class BlockBuffer:
+    '''Bounded FIFO of data blocks shared by a reader and a processing thread'''
+
+    def __init__(self, capacity=BACKLOG_CAPACITY):
+        self.capacity = capacity
+        self.blocks = collections.deque()
+        self.size = 0
+        self.max_size = 0
+        self.stall_time = 0.0
+        self.closed = False
+        self.cond = threading.Condition()
+
+
+    def put(self, block):
+        '''Append a block. Wait for a free room if the buffer is full.'''
+        with self.cond:
+            if self.size >= self.capacity:
+                start = time.monotonic()
+                while self.size >= self.capacity:
+                    self.cond.wait()
+                self.stall_time += time.monotonic() - start
+            self.blocks.append(block)
+            self.size += len(block)
+            self.max_size = max(self.max_size, self.size)
+            self.cond.notify_all()
+
+
+    def close(self):
+        '''No more blocks would be added'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+    def take(self):
+        '''Wait for data and take everything collected so far. Return `None` at EOF.'''
+        with self.cond:
+            while not self.blocks and not self.closed:
+                self.cond.wait()
+            if not self.blocks:
+                return None
+            data = self.blocks[0] if len(self.blocks) == 1 else b''.join(self.blocks)
+            self.blocks.clear()
+            self.size = 0
+            self.cond.notify_all()
+            return data
+
+
+class Reader(threading.Thread):
+    ''' Read a stream into a `BlockBuffer` until EOF
+
+        If a `watcher` is given, stop shortly after it reports the wrapped executable
+        has exited, even if its output is still held open by some descendant process.
+    '''
+
+    def __init__(self, stream, buffer, watcher=None):
+        super().__init__(name='outproc-reader', daemon=True)
+        self.stream = stream
+        self.buffer = buffer
+        self.watcher = watcher
+        self.error = None
+
+
+    def run(self):
+        try:
+            self._read_loop()
+        except BaseException as ex:
+            self.error = ex                                 # Let the processing thread re-raise it
+        finally:
+            self.buffer.close()
+
+
+    def _read_available(self):
+        '''Read all data available in a (nonblocking) stream'''
+        while True:
+            try:
+                block = os.read(self.stream.fileno(), READ_BLOCK_SIZE)
+            except BlockingIOError:
+                return                                      # No more data for now
+            except OSError as ex:
+                # NOTE Reading from a master side of a PTY gives EIO
+                # when the slave side is closed
+                if ex.errno != errno.EIO:
+                    raise
+                return
+            if not block:
+                return
+            stats.add('bytes-read', len(block))
+            self.buffer.put(block)
+
+
+    def _read_loop(self):
+        fd = self.stream.fileno()
+        # Switch descriptor to asynchronous mode
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        po = select.epoll()                                 # Make a poll object
+        # Register descriptors for polling
+        po.register(fd, select.EPOLLIN | select.EPOLLHUP)
+        if self.watcher is not None:
+            po.register(self.watcher, select.EPOLLIN)
+
+        try:
+            timeout = -1
+            eof = False
+            while not eof:
+                # Wait for data to become available
+                events = po.poll(timeout)
+
+                # Nothing has been written since the child exit?
+                if not events:
+                    break
+
+                # Analyze event
+                for fileno, event in events:
+                    if self.watcher is not None and fileno == self.watcher.fileno():
+                        if self.watcher.exited():
+                            po.unregister(self.watcher)
+                            # NOTE Data written to a PTY right before exit may appear
+                            # w/ a small delay, so give it a chance to arrive
+                            timeout = _EXIT_GRACE_PERIOD
+                    # Check if input available
+                    elif event & select.EPOLLIN:
+                        self._read_available()
+                    elif event & select.EPOLLHUP:
+                        eof = True
+                    else:
+                        assert False, 'Unexpected event {}'.format(event)
+        finally:
+            po.close()
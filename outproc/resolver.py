@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Find a wrapped executable in `PATH`
+
+    A result is cached per executable name. A cache entry is valid for the same
+    `PATH` value and as long as every directory looked up (till the one the executable
+    was found in) remains unchanged. So a typical lookup costs a single read and
+    a `stat()` per directory instead of a bunch of `stat()`/`readlink()` calls
+    per candidate.
+
+    NOTE This module is used by the bypass path, so it must import
+    nothing but a bare minimum!
+'''
+
+# Project specific imports
+from . import cache
+
+# Standard imports
+import os
+
+
+_CACHE_SUBDIR = 'binaries'
+
+
+def _directory_signature(directory):
+    try:
+        st = os.stat(directory or '.')
+    except OSError:
+        return '-'
+    return '{}:{}:{}'.format(st.st_dev, st.st_ino, st.st_mtime_ns)
+
+
+def _is_wrapped_binary(binary, real_executable_name):
+    # NOTE Skip the current executable (i.e. a symlink to `outproc`) and
+    # everything in `outproc` directories (e.g. `/usr/lib/outproc/bin`)
+    return os.path.exists(binary) \
+      and os.path.realpath(binary) != real_executable_name \
+      and 'outproc' not in binary.split(os.sep)
+
+
+def _walk_path(name, real_executable_name, path):
+    ''' Look up for an executable in a given `PATH`
+
+        Return a tuple of a binary found (or `None`) and a list
+        of directory signatures looked up.
+    '''
+    signatures = []
+    for directory in path.split(os.pathsep):
+        signatures.append((directory, _directory_signature(directory)))
+        binary = os.path.join(directory, name)
+        if _is_wrapped_binary(binary, real_executable_name):
+            return (binary, signatures)
+    return (None, signatures)
+
+
+def _load(name, real_executable_name, path):
+    data = cache.read_file(_CACHE_SUBDIR, name)
+    if data is None:
+        return None
+    try:
+        lines = data.decode('utf-8').split('\n')
+    except UnicodeDecodeError:
+        return None
+    if len(lines) < 4 or lines[0] != real_executable_name or lines[1] != path:
+        return None
+
+    for line in lines[3:]:
+        directory, sep, signature = line.rpartition('\t')
+        if not sep or _directory_signature(directory) != signature:
+            return None
+
+    return lines[2] if os.path.exists(lines[2]) else None
+
+
+def _store(name, real_executable_name, path, binary, signatures):
+    if '\n' in path or '\n' in binary:
+        return False
+    lines = [real_executable_name, path, binary] \
+      + ['{}\t{}'.format(directory, signature) for directory, signature in signatures]
+    return cache.write_file('\n'.join(lines).encode('utf-8'), _CACHE_SUBDIR, name)
+
+
+def find_wrapped_binary(name, real_executable_name, use_cache=True):
+    ''' Find an executable to wrap. Return `None` if not found.
+
+        `real_executable_name` is a real path of the current executable (`outproc`),
+        so symlinks to it are skipped.
+    '''
+    path = os.environ.get('PATH', '')
+    if use_cache:
+        binary = _load(name, real_executable_name, path)
+        if binary is not None:
+            return binary
+
+    binary, signatures = _walk_path(name, real_executable_name, path)
+    if binary is not None:
+        _store(name, real_executable_name, path, binary, signatures)
+    return binary
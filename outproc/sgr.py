@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+    Removal of redundant SGR (color) escape sequences from output
+
+    Plugins emit colors w/o knowing what is active already (e.g. most of
+    colors start w/ a reset), so processed output has a lot of back-to-back
+    resets and switches to the current color. The terminal state gets tracked
+    here, and a run of SGR sequences is replaced w/ the shortest transition
+    to the resulting state right before the next printable text.
+
+    NOTE The state is not carried over between writes: other processes may
+    write to the same terminal in between.
+'''
+
+# Project specific imports
+from . import stats
+
+# Standard imports
+import functools
+import re
+
+
+_SGR_RE = re.compile('\x1b\\[([0-9;]*)m')
+_SGR_RUN_RE = re.compile('\x1b\\[[0-9;]*m(?:\x1b\\[[0-9;]*m)*')
+
+# Attribute bits are indexed by SGR codes to turn them on
+_ATTRIBUTES = (1, 2, 3, 4, 5, 7, 8, 9)
+# Codes to turn attributes off (`22` is for both bold and dim)
+_ATTRIBUTES_OFF = {
+    22: (1 << 1) | (1 << 2)
+  , 23: 1 << 3
+  , 24: 1 << 4
+  , 25: 1 << 5
+  , 27: 1 << 7
+  , 28: 1 << 8
+  , 29: 1 << 9
+  }
+
+# Terminal state is a tuple of attribute bits, foreground and background colors
+# (`None` for default ones). The state is unknown if `None`.
+_DEFAULT = (0, None, None)
+
+
+@functools.lru_cache(maxsize=1024)
+def _apply(state, params):
+    ''' Get a state after a given SGR sequence (specified by its parameters)
+
+        Return `None` if the result is unknown (e.g. unsupported code).
+    '''
+    codes = [int(c) if c else 0 for c in params.split(';')]
+    if state is None:
+        if codes[0] != 0:                                   # Nothing known w/o a reset first
+            return None
+        state = _DEFAULT
+    attributes, fg, bg = state
+
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        if code == 0:
+            attributes, fg, bg = _DEFAULT
+        elif code in _ATTRIBUTES:
+            attributes |= 1 << code
+        elif code in _ATTRIBUTES_OFF:
+            attributes &= ~_ATTRIBUTES_OFF[code]
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            fg = str(code)
+        elif code == 39:
+            fg = None
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            bg = str(code)
+        elif code == 49:
+            bg = None
+        elif code in (38, 48):
+            # Extended colors: `38;5;<index>` or `38;2;<r>;<g>;<b>`
+            size = {5: 3, 2: 5}.get(codes[i + 1] if i + 1 < len(codes) else None)
+            if size is None or len(codes) < i + size:
+                return None
+            color = ';'.join(str(c) for c in codes[i:i + size])
+            if code == 38:
+                fg = color
+            else:
+                bg = color
+            i += size - 1
+        else:
+            return None
+        i += 1
+
+    return (attributes, fg, bg)
+
+
+def _set_codes(attributes, fg, bg):
+    codes = [str(code) for code in _ATTRIBUTES if attributes & (1 << code)]
+    if fg is not None:
+        codes.append(fg)
+    if bg is not None:
+        codes.append(bg)
+    return codes
+
+
+@functools.lru_cache(maxsize=1024)
+def _transition(current, target):
+    '''Get the shortest sequence to switch from a current state to a target one'''
+    assert target is not None
+    full = ['0'] + _set_codes(*target)
+    if current is None:
+        return '\x1b[{}m'.format(';'.join(full))
+
+    codes = []
+    turned_off = current[0] & ~target[0]
+    turned_on = target[0] & ~current[0]
+    for code, bits in _ATTRIBUTES_OFF.items():
+        if turned_off & bits:
+            codes.append(str(code))
+            turned_on |= target[0] & bits                   # E.g. keep dim when bold is off
+    codes += _set_codes(turned_on, None, None)
+    if current[1] != target[1]:
+        codes.append(target[1] or '39')
+    if current[2] != target[2]:
+        codes.append(target[2] or '49')
+
+    codes = min(codes, full, key=lambda c: len(';'.join(c)))
+    return '\x1b[{}m'.format(';'.join(codes)) if codes else ''
+
+
+@functools.lru_cache(maxsize=4096)
+def _replace_run(state, run):
+    ''' Get the shortest replacement for a run of SGR sequences
+
+        Return a terminal state after the replacement and the replacement itself.
+    '''
+    parts = []
+    target = state                                          # State requested by sequences seen so far
+    pending = ''                                            # Sequences to replace
+    for match in _SGR_RE.finditer(run):
+        new_target = _apply(target, match.group(1))
+        if new_target is None:
+            # Unknown result: flush what is pending and pass the sequence as is
+            if pending:
+                parts.append(min(pending, _transition(state, target), key=len))
+            parts.append(match.group())
+            state = target = None
+            pending = ''
+        else:
+            target = new_target
+            pending += match.group()
+
+    if pending:
+        parts.append(min(pending, _transition(state, target), key=len))
+    return (target, ''.join(parts))
+
+
+def optimize(text):
+    ''' Remove redundant SGR sequences from a given text
+
+        Visible text (and line breaks) are rendered exactly as before.
+    '''
+    if '\x1b' not in text:
+        return text
+
+    state = None                                            # Unknown at start
+
+    def replace(match):
+        nonlocal state
+        state, replacement = _replace_run(state, match.group())
+        return replacement
+
+    result = _SGR_RUN_RE.sub(replace, text)
+    stats.add('sgr-bytes-saved', len(text) - len(result))
+    return result
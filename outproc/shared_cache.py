@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    On-disk cache shared by concurrent processes
+
+    Backed by SQLite in WAL mode, so many readers don't block each other
+    (and a writer). Any database error (locked for too long, read-only,
+    corrupted, etc) just disables the cache for the current process --
+    it is an optimization only.
+'''
+
+# Project specific imports
+from . import cache, stats
+
+# Standard imports
+import hashlib
+import os
+import sqlite3
+import time
+
+
+# How long (in seconds) to wait for a lock
+_BUSY_TIMEOUT = 0.5
+# Write new entries in batches (one transaction per batch)
+_BATCH_SIZE = 64
+# Check the total size (and evict old entries) every N batches
+_EVICTION_CHECK_PERIOD = 8
+# Do not update an access time of an entry more often (in seconds)
+_TOUCH_PERIOD = 60
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS entries (
+          key BLOB PRIMARY KEY
+        , value TEXT NOT NULL
+        , size INTEGER NOT NULL
+        , used INTEGER NOT NULL
+        )'''
+  , 'CREATE INDEX IF NOT EXISTS entries_used ON entries (used)'
+  ]
+
+
+def make_key(*parts):
+    '''Make a key from a given list of parts (converted to strings)'''
+    digest = hashlib.sha1()
+    for part in parts:
+        data = str(part).encode('utf-8', 'surrogateescape')
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.digest()[:16]
+
+
+class SharedCache:
+    ''' Size limited key/value cache shared by processes
+
+        Least recently used entries get evicted when the total size
+        of values exceeds the capacity.
+    '''
+
+    def __init__(self, filename, capacity, name=None):
+        self.filename = filename
+        self.capacity = capacity
+        self.connection = None
+        self.pid = None
+        self.disabled = False
+        self.pending = []
+        self.batches = 0
+        self.hits_counter = None if name is None else name + '-cache-hits'
+        self.misses_counter = None if name is None else name + '-cache-misses'
+
+
+    @staticmethod
+    def in_cache_dir(name, capacity):
+        '''Make a cache w/ a database in the user's cache directory'''
+        return SharedCache(os.path.join(cache.cache_dir(), name + '.sqlite'), capacity, name)
+
+
+    def _connect(self):
+        # NOTE A connection must not be shared w/ a forked process (e.g. a parallel worker)
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        os.makedirs(os.path.dirname(self.filename), mode=0o700, exist_ok=True)
+        connection = sqlite3.connect(self.filename, timeout=_BUSY_TIMEOUT, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        self.connection = connection
+        self.pid = os.getpid()
+        return connection
+
+
+    def _disable(self):
+        self.disabled = True
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+
+
+    def get(self, key):
+        ''' Get a cached value or `None` '''
+        if self.disabled:
+            return None
+        try:
+            connection = self._connect()
+            row = connection.execute('SELECT value, used FROM entries WHERE key = ?', (key, )).fetchone()
+            if row is not None:
+                now = int(time.time())
+                if _TOUCH_PERIOD < now - row[1]:
+                    connection.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+        except (OSError, sqlite3.Error):
+            self._disable()
+            return None
+
+        if row is None:
+            if self.misses_counter is not None:
+                stats.add(self.misses_counter)
+            return None
+        if self.hits_counter is not None:
+            stats.add(self.hits_counter)
+        return row[0]
+
+
+    def put(self, key, value):
+        ''' Add an entry (actually written by a batch, see `flush()`) '''
+        if self.disabled or self.capacity < len(value):
+            return
+        self.pending.append((key, value, len(value), int(time.time())))
+        if _BATCH_SIZE <= len(self.pending):
+            self.flush()
+
+
+    def flush(self):
+        ''' Write pending entries '''
+        if not self.pending or self.disabled:
+            return
+        pending = self.pending
+        self.pending = []
+        try:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany('INSERT OR REPLACE INTO entries (key, value, size, used) VALUES (?, ?, ?, ?)', pending)
+                connection.execute('COMMIT')
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            self.batches += 1
+            if self.batches % _EVICTION_CHECK_PERIOD == 1:
+                self._evict(connection)
+        except sqlite3.OperationalError:
+            pass                                            # E.g. the database is locked for too long
+        except (OSError, sqlite3.Error):
+            self._disable()
+
+
+    def _evict(self, connection):
+        total = connection.execute('SELECT TOTAL(size) FROM entries').fetchone()[0]
+        if total <= self.capacity:
+            return
+        # Remove least recently used entries to free a quarter of the capacity
+        excess = total - self.capacity * 3 / 4
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            freed = 0
+            keys = []
+            for key, size in connection.execute('SELECT key, size FROM entries ORDER BY used, rowid'):
+                keys.append((key, ))
+                freed += size
+                if excess <= freed:
+                    break
+            connection.executemany('DELETE FROM entries WHERE key = ?', keys)
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
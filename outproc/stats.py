@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Performance counters
+
+    Collected unconditionally (it is cheap) and reported to STDERR at exit
+    if `OUTPROC_STATS` environment variable is set.
+'''
+
+# Standard imports
+import os
+import sys
+
+
+_STATS_ENV = 'OUTPROC_STATS'
+
+_counters = {}
+
+
+def add(name, value=1):
+    '''Increase a counter by a given value'''
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def maximum(name, value):
+    '''Remember the largest value seen'''
+    _counters[name] = max(_counters.get(name, value), value)
+
+
+def get(name, default=0):
+    return _counters.get(name, default)
+
+
+def reset():
+    _counters.clear()
+
+
+def requested():
+    return bool(os.environ.get(_STATS_ENV))
+
+
+def report():
+    '''Write collected counters to STDERR (if requested)'''
+    if not requested() or not _counters:
+        return
+    for name in sorted(_counters):
+        value = _counters[name]
+        if isinstance(value, float):
+            value = '{:.3f}'.format(value)
+        print('outproc: {}: {}'.format(name, value), file=sys.stderr)
+    sys.stderr.flush()
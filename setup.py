@@ -50,7 +50,7 @@ setup(
   , packages         = ['outproc', 'outproc.pp']
   , entry_points       = {
         'console_scripts': [
-            'outproc = outproc.cli:main'
+            'outproc = outproc.launcher:main'
           ]
       }
   , data_files       = [
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for the application (w/ a real wrapped executable or a pipe)
+'''
+
+# Project specific imports
+import outproc.cli
+from outproc.cli import Application
+from outproc.config import Config
+from outproc.processing import ChildWatcher, Processor
+
+# Standard imports
+import os
+import pathlib
+import pytest
+import signal
+import subprocess
+import sys
+import time
+
+
+class pipe_mode_tester:
+
+    @pytest.fixture
+    def run(self, tmp_path, monkeypatch, capfd):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        monkeypatch.delenv('OUTPROC_HANDOFF', raising=False)
+
+        def run(module, data, block_size=outproc.cli._PIPE_MODE_BLOCK_SIZE):
+            monkeypatch.setattr(outproc.cli, '_PIPE_MODE_BLOCK_SIZE', block_size)
+            read_fd, write_fd = os.pipe()
+            os.write(write_fd, data)
+            os.close(write_fd)
+            with open(read_fd, 'rb') as stdin:
+                monkeypatch.setattr(sys, 'stdin', stdin)
+                app = Application()
+                app.basename = module
+                assert app._run_pipe_mode() == 0
+            return capfd.readouterr().out
+        return run
+
+
+    @pytest.mark.parametrize(
+        'data, expected'
+      , [
+            (b'', '')
+          , (b'one\ntwo\n', 'one\ntwo\n')
+            # The last line w/o a line break
+          , (b'one\ntwo', 'one\ntwo\n')
+          , (b'\n', '\n')
+        ]
+      )
+    def lines_test(self, run, data, expected):
+        assert run('cmake', data) == expected
+
+
+    def split_utf8_test(self, run):
+        # NOTE Read by 1 byte, so every multibyte character gets split
+        assert run('cmake', 'При\nвет'.encode(), 1) == 'При\nвет\n'
+
+
+    def hidden_tail_test(self, run):
+        # NOTE `gcc` holds a code snippet until a caret line
+        assert run('gcc', b'   foo(v, 1);') == ''
+
+
+class child_watcher_tester:
+
+    @pytest.mark.parametrize('use_pidfd', [True, False])
+    def descendant_holds_output_test(self, monkeypatch, capfd, use_pidfd):
+        if not use_pidfd:
+            monkeypatch.delattr(os, 'pidfd_open', raising=False)   # Force a `SIGCHLD` self-pipe
+        elif not hasattr(os, 'pidfd_open'):
+            pytest.skip('`pidfd` is not supported')
+
+        read_fd, write_fd = os.pipe()
+        # NOTE A background process inherits (and holds) the output pipe
+        process = subprocess.Popen(
+            ['sh', '-c', 'echo one; sleep 30 & exit 3']
+          , stdout=write_fd
+          , start_new_session=True
+          )
+        os.close(write_fd)
+        watcher = ChildWatcher(process)
+        try:
+            assert (watcher.wakeup_fd is None) == use_pidfd
+            start = time.monotonic()
+            with open(read_fd, 'rb') as stream:
+                Application()._process_output(Processor(Config(pathlib.Path('doesnt-matter')), 'sh'), stream, watcher)
+            assert time.monotonic() - start < 10
+        finally:
+            watcher.close()
+            os.killpg(process.pid, signal.SIGKILL)
+
+        assert process.wait() == 3
+        assert capfd.readouterr().out == 'one\n'
+
+
+class pty_tester:
+
+    def use_pty_test(self, tmp_path, monkeypatch, capfd):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        monkeypatch.delenv('OUTPROC_HANDOFF', raising=False)
+        conf = tmp_path / 'cmake.conf'
+        conf.write_text('use-pty = true\n')
+        monkeypatch.setattr(
+            sys
+          , 'argv'
+          , ['cmake', '-c', 'import os, sys; print("isatty={}".format(os.isatty(1))); print("done"); sys.exit(5)']
+          )
+
+        stdin = open(os.devnull)
+        monkeypatch.setattr(sys, 'stdin', stdin)
+
+        app = Application()
+        app.basename = 'cmake'
+        app.binary = pathlib.Path(sys.executable)
+        app._load_pp_module()
+        sigwinch_handler = signal.getsignal(signal.SIGWINCH)
+        try:
+            assert app._run_wrapped_binary(Config(conf, use_cache=False)) == 5
+        finally:
+            signal.signal(signal.SIGWINCH, sigwinch_handler)
+            stdin.close()
+
+        # NOTE No '\n' --> '\r\n' translation
+        assert capfd.readouterr().out == 'isatty=True\ndone\n'
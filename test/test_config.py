@@ -81,3 +81,35 @@ class config_tester:
         assert cfg.get_bool('false-bool-key-2') == False
         with pytest.raises(ValueError):
             cfg.get_bool('some-int')
+
+
+class config_cache_tester:
+
+    @pytest.fixture(autouse=True)
+    def setup_cache(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        self.filename = tmp_path / 'sample.conf'
+        self.filename.write_text(make_data_filename('sample.conf').read_text())
+
+
+    def cached_colors_test(self):
+        cfg = Config(self.filename)
+        assert cfg.get_color('error', 'normal') == '\x1b[0m\x1b[31m\x1b[1m'
+        cfg.save_cache()
+
+        cfg = Config(self.filename)
+        assert not cfg.cache_is_dirty
+        cfg._resolve_color = None                           # Must not be called
+        assert cfg.get_color('error', 'normal') == '\x1b[0m\x1b[31m\x1b[1m'
+        assert cfg.get_int('some-int') == 123
+
+
+    def invalidate_test(self):
+        cfg = Config(self.filename)
+        cfg.get_color('error', 'normal')
+        cfg.save_cache()
+
+        self.filename.write_text('error = blue\n')
+        cfg = Config(self.filename)
+        assert cfg.cache_is_dirty
+        assert cfg.get_color('error', 'normal') == '\x1b[0m\x1b[34m'
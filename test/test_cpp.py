@@ -23,7 +23,7 @@
 
 # Project specific imports
 from context import make_data_filename
-from outproc.cpp_helpers import SimpleCppLexer, SnippetSanitizer, CodeFormatter
+from outproc.cpp_helpers import CodeFormatter, CodeTree, SimpleCppLexer, SnippetSanitizer
 
 # Standard imports
 import pytest
@@ -75,6 +75,33 @@ class simple_cpp_lexer_tester:
         assert stmt == input_line
 
 
+    @pytest.mark.parametrize(
+        'input_line, expected'
+      , [
+            ('const std::string s', [('const', 'MODIFIER'), (' ', 'UNCATEGORIZED'), ('std::string', 'IDENTIFIER'), (' ', 'UNCATEGORIZED'), ('s', 'IDENTIFIER')])
+          , ('f(42u, "x"_s)', [('f', 'IDENTIFIER'), ('(', 'UNCATEGORIZED'), ('42u', 'NUMERIC_LITERAL'), (', ', 'UNCATEGORIZED'), ('"x"_s', 'STRING_LITERAL'), (')', 'UNCATEGORIZED')])
+          , ('LR"(a\\")"', [('LR"(a\\")"', 'STRING_LITERAL')])
+          , ("x = '\\'' + y", [('x', 'IDENTIFIER'), (' = ', 'UNCATEGORIZED'), ("'\\''", 'STRING_LITERAL'), (' + ', 'UNCATEGORIZED'), ('y', 'IDENTIFIER')])
+          , ('a \\" b', [('a', 'IDENTIFIER'), (' \\" ', 'UNCATEGORIZED'), ('b', 'IDENTIFIER')])
+          , ('int /**//x', [('int', 'BUILTIN_TYPE'), (' ', 'UNCATEGORIZED'), ('/**/', 'COMMENT'), ('/', 'UNCATEGORIZED'), ('x', 'IDENTIFIER')])
+          , ('  #include <foo>', [('  #include <foo>', 'PREPROCESSOR')])
+        ]
+      )
+    def token_kinds_test(self, input_line, expected):
+        tokens = SimpleCppLexer.tokenize_string(input_line)
+        assert [(t.token, t.kind) for t in tokens] == [(text, getattr(SimpleCppLexer.Token, kind)) for text, kind in expected]
+
+
+    def scan_test(self):
+        snippet = 'std::vector<int> v = {1, 2}; // u8"text"'
+        starts, ends, kinds = SimpleCppLexer.scan(snippet)
+        assert starts[0] == 0 and ends[-1] == len(snippet)
+        assert list(starts[1:]) == list(ends[:-1])          # Tokens are adjacent
+        assert [snippet[start:end] for start, end in zip(starts, ends)] \
+          == [t.token for t in SimpleCppLexer.tokenize_string(snippet)]
+        assert list(kinds) == [t.kind for t in SimpleCppLexer.tokenize_string(snippet)]
+
+
 class cpp_sanitizer_tester:
 
 
@@ -181,6 +208,22 @@ class cpp_sanitizer_tester:
                 'Multiple std::forward_list<int, std::allocator<int> > matches std::vector<char, std::allocator<char>> here'
               , 'Multiple std::forward_list<int> matches std::vector<char> here'
             )
+          , (
+                'std::vector<std::list<long int, std::allocator<long int> >, std::allocator<std::list<long int, std::allocator<long int> > > >'
+              , 'std::vector<std::list<long>>'
+            )
+          , (
+                'std::deque<bool (*)(int, int), std::allocator<bool (*)(int, int)> > std::operator< <int>(int, int)'
+              , 'std::deque<bool (*)(int, int)> std::operator< <int>(int, int)'
+            )
+          , (
+                'std::vector<int, my_allocator<int> > and std::list<int, std::allocator<char> >'
+              , 'std::vector<int, my_allocator<int>> and std::list<int, std::allocator<char>>'
+            )
+          , (
+                'std::tuple<std::_Placeholder<1>, std::_Placeholder<2> > > >'
+              , 'std::tuple<std::placeholders::_1, std::placeholders::_2 >>>'
+            )
           , (
                 'template <class Derived1, class V1, class TC1, class Reference1, class Difference1, class Derived2, class V2, class TC2, class Reference2, class Difference2> typename boost::iterators::detail::enable_if_interoperable<Derived1, Derived2, typename boost::mpl::apply2<boost::iterators::detail::always_bool2, Derived1, Derived2>::type>::type boost::iterators::operator!=(const boost::iterators::iterator_facade<Derived1, V1, TC1, Reference1, Difference1>&, const boost::iterators::iterator_facade<Derived2, V2, TC2, Reference2, Difference2>&)'
               , 'template <class Derived1, class V1, class TC1, class Reference1, class Difference1, class Derived2, class V2, class TC2, class Reference2, class Difference2> typename boost::iterators::detail::enable_if_interoperable<Derived1, Derived2, typename boost::mpl::apply2<boost::iterators::detail::always_bool2, Derived1, Derived2>::type>::type boost::iterators::operator!=(const boost::iterators::iterator_facade<Derived1, V1, TC1, Reference1, Difference1>&, const boost::iterators::iterator_facade<Derived2, V2, TC2, Reference2, Difference2>&)'
@@ -193,6 +236,32 @@ class cpp_sanitizer_tester:
 
 
 
+class code_tree_tester:
+
+    def shared_subtrees_test(self):
+        snippet = 'foo(std::vector<std::pair<int, long>>, std::vector<std::pair<int, long>>) const'
+        tree = CodeTree.parse(snippet)
+        assert tree.render(lambda text: text) == snippet
+        # Both `std::vector<...>' arguments refer to the same node
+        assert tree.nodes[tree.root] == ('foo', 2, ' const')
+        assert tree.nodes[2] == ('(std::vector', 1, ', std::vector', 1, ')')
+
+
+    def render_once_test(self):
+        rendered = []
+        def render_text(text):
+            rendered.append(text)
+            return text.upper()
+        tree = CodeTree.parse('f(A<b>, A<b>, A<b>)')
+        assert tree.render(render_text) == 'F(A<B>, A<B>, A<B>)'
+        assert sorted(rendered) == sorted(['f', '(A', '<b>', ', A', ')'])
+
+
+    @pytest.mark.parametrize('snippet', ['foo(', 'foo)', 'std::vector<int', 'a < b)', 'f(a>b)'])
+    def unbalanced_test(self, snippet):
+        assert CodeTree.parse(snippet) is None
+
+
 class code_formatter_tester:
 
     @pytest.mark.parametrize(
@@ -226,6 +295,16 @@ class code_formatter_tester:
 
         assert result == expected_text
 
+
+    def many_long_args_test(self):
+        arg = 'std::vector<{}>'.format(50 * 'x')
+        snippet = 'f(' + ', '.join([arg] * 2000) + ')'
+        lines = CodeFormatter(40).pretty_format(snippet).split('\n')
+        assert lines[:4] == ['f(', '    std::vector<', '        ' + 50 * 'x', '      >']
+        assert lines[4:8] == ['  , std::vector<', '        ' + 50 * 'x', '      >', '  , std::vector<']
+        assert lines[-1] == '  )'
+        assert len(lines) == 2 + 2000 * 3
+
     def print_test(self):
         formatter = CodeFormatter(150)
         snippet='template<class Derived1, class V1, class TC1, class Reference1, class Difference1, class Derived2, class V2, class TC2, class Reference2, class Difference2> typename boost::iterators::detail::enable_if_interoperable<Derived1, Derived2, typename boost::mpl::apply2<boost::iterators::detail::always_bool2, Derived1, Derived2>::type>::type boost::iterators::operator!=(const boost::iterators::iterator_facade<Derived1, V1, TC1, Reference1, Difference1>&, const boost::iterators::iterator_facade<Derived2, V2, TC2, Reference2, Difference2>&)'
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+    Pathological inputs for C++ snippets helpers: no crashes, no superlinear blow-ups
+
+    Adversarial snippets are generated at two sizes. Timing checks are relative
+    (a snippet `_SCALE` times bigger may take not much more than `_SCALE` times
+    longer), so they don't depend on a machine speed.
+
+    Run w/ `--save-patterns` to save minimized crashing (or hanging) inputs as
+    `CppFuzz.<pattern>.<target>.input` regression fixtures.
+'''
+
+# Project specific imports
+from context import data_dir_base, make_data_filename
+from outproc.config import Config
+from outproc.cpp_helpers import CodeFormatter, CodeTree, SimpleCppLexer, SnippetSanitizer
+from outproc.pp.gcc import Processor
+
+# Standard imports
+import contextlib
+import gc
+import pytest
+import signal
+import time
+
+
+_SIZE = 2048
+_SCALE = 16
+_SLACK = 3
+_REPEAT = 3
+_NOISE_SECONDS = 0.02
+_DEADLINE_SECONDS = 10
+_FIXTURE_PREFIX = 'CppFuzz.'
+
+
+def _repeat(unit, size, head='', tail=''):
+    return head + unit * max(1, (size - len(head) - len(tail)) // len(unit)) + tail
+
+
+def _nest(open_text, text, close_text, size):
+    depth = max(1, (size - len(text)) // (len(open_text) + len(close_text)))
+    return open_text * depth + text + close_text * depth
+
+
+def _template_params(size):
+    return ', '.join('class T{}'.format(i) for i in range(max(1, size // 10)))
+
+
+_PATTERNS = {
+    'unbalanced-quotes': lambda size: _repeat('"a\\', size)
+  , 'unbalanced-char-literals': lambda size: _repeat("'a", size)
+  , 'unterminated-comment': lambda size: _repeat('x<', size, head='/*')
+  , 'empty-comments': lambda size: _repeat('/**/', size)
+  , 'deep-angle-brackets': lambda size: _nest('<', 'T', '>', size)
+  , 'deep-parens': lambda size: _nest('(', 'x', ')', size)
+  , 'deep-std-types': lambda size: _nest('std::vector<', 'int', '>', size)
+  , 'nested-allocators': lambda size: _nest('std::vector<', 'int', ', std::allocator<int> >', size)
+  , 'open-angle-brackets': lambda size: _repeat('<', size)
+  , 'right-angle-brackets': lambda size: _repeat('> >', size)
+  , 'spaced-right-angle-brackets': lambda size: _repeat('> ', size)
+  , 'operators': lambda size: _repeat('operator< <', size)
+  , 'placeholders': lambda size: _repeat('std::_Placeholder<', size)
+  , 'parameter-packs': lambda size: _repeat('T ...', size)
+  , 'builtin-types': lambda size: _repeat('long unsigned int ', size)
+  , 'template-params': _template_params
+  , 'commas': lambda size: _repeat(',', size, head='f(', tail=')')
+  , 'with-lists': lambda size: _repeat('T = int; ', size, head='f [with ', tail='U = int]')
+  , 'nested-with-lists': lambda size: _nest('f [with T = ', 'int', ']', size)
+  , 'unterminated-with-list': lambda size: _repeat('[', size, head='f [with ')
+  , 'truncated-with-list': lambda size: _repeat('T = int; ', size, head='f [with ')
+  , 'empty-with-arguments': lambda size: _repeat(' ', size, head='f [with ;', tail=']')
+  }
+
+_TARGETS = [
+    'lexer'
+  , 'sanitizer'
+  , 'formatter'
+  , 'code-tree'
+  , 'gcc'
+  , 'gcc-color-only'
+  ]
+
+
+@pytest.fixture(scope='module')
+def targets(tmp_path_factory):
+    conf = tmp_path_factory.mktemp('cpp_fuzz') / 'gcc.conf'
+    conf.write_text('max-code-snippet-length = 40\n')
+    # NOTE `_render_code_snippet()` has no guardrails and cache of `_handle_code_snippet()`
+    processor = Processor(Config(conf, use_cache=False), 'gcc')
+    formatter = CodeFormatter(40)
+    return {
+        'lexer': SimpleCppLexer.tokenize_string
+      , 'sanitizer': SnippetSanitizer.cleanup_snippet
+      , 'formatter': formatter.pretty_format
+      , 'code-tree': lambda snippet: CodeTree.parse(snippet) and CodeTree.parse(snippet).render(str.upper)
+      , 'gcc': lambda snippet: processor._render_code_snippet(snippet, '', False)
+      , 'gcc-color-only': lambda snippet: processor._render_code_snippet(snippet, '', True)
+      }
+
+
+@contextlib.contextmanager
+def _deadline(seconds):
+    def _expired(signum, frame):
+        raise TimeoutError('Still running after {} seconds'.format(seconds))
+
+    handler = signal.signal(signal.SIGALRM, _expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+
+def _run(target, snippet):
+    best = None
+    gc.disable()
+    try:
+        with _deadline(_DEADLINE_SECONDS):
+            for _ in range(_REPEAT):
+                start = time.perf_counter()
+                target(snippet)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best
+
+
+def _crashes(target, snippet, error_type, seconds):
+    try:
+        with _deadline(seconds):
+            target(snippet)
+    except error_type:
+        return True
+    except Exception:
+        pass
+    return False
+
+
+def _minimize(target, snippet, error_type, seconds=1):
+    ''' Remove chunks of a given snippet while it still crashes w/ the same error '''
+    chunk = len(snippet) // 2
+    while chunk:
+        i = 0
+        while i < len(snippet):
+            candidate = snippet[:i] + snippet[i + chunk:]
+            if _crashes(target, candidate, error_type, seconds):
+                snippet = candidate
+            else:
+                i += chunk
+        chunk //= 2
+    return snippet
+
+
+def _save_fixture(pattern, target_name, target, error_type):
+    # Start from the smallest crashing size
+    size = 16
+    while size < _SIZE and not _crashes(target, _PATTERNS[pattern](size), error_type, 1):
+        size *= 2
+    snippet = _minimize(target, _PATTERNS[pattern](size), error_type) + '\n'
+    if any(path.read_text() == snippet for path in data_dir_base().glob(_FIXTURE_PREFIX + '*.input')):
+        return                                              # Already have the same one
+    make_data_filename('{}{}.{}.input'.format(_FIXTURE_PREFIX, pattern, target_name)).write_text(snippet)
+
+
+@pytest.mark.parametrize('target_name', _TARGETS)
+@pytest.mark.parametrize('pattern', sorted(_PATTERNS))
+def pathological_input_test(request, targets, pattern, target_name):
+    target = targets[target_name]
+    try:
+        small = _run(target, _PATTERNS[pattern](_SIZE))
+        big = _run(target, _PATTERNS[pattern](_SIZE * _SCALE))
+    except Exception as ex:
+        if request.config.getoption('save_patterns'):
+            _save_fixture(pattern, target_name, target, type(ex))
+        raise
+
+    assert big < _NOISE_SECONDS or big < small * _SCALE * _SLACK, \
+        'Superlinear: {:.4f}s for {} chars vs {:.4f}s for {} chars'.format(big, _SIZE * _SCALE, small, _SIZE)
+
+
+@pytest.mark.parametrize(
+    'fixture'
+  , sorted(path.name for path in data_dir_base().glob(_FIXTURE_PREFIX + '*.input'))
+  )
+def fuzz_fixture_test(targets, fixture):
+    snippet = make_data_filename(fixture).read_text()[:-1]
+    for target in targets.values():
+        _run(target, snippet)
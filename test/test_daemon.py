@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for the daemon protocol
+'''
+
+# Project specific imports
+from outproc import daemon
+from outproc.cli import Application
+
+# Standard imports
+import os
+import pathlib
+import pytest
+import shutil
+import socket
+import sys
+import threading
+
+
+class _Watcher:
+    '''The wrapped executable never exits: wait until the daemon is done'''
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+
+    def fileno(self):
+        return self.read_fd
+
+
+    def exited(self):
+        return False
+
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class daemon_tester:
+
+    @pytest.fixture
+    def environment(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('OUTPROC_SOCKET', str(tmp_path / 'outproc.sock'))
+        monkeypatch.setenv('HOME', str(tmp_path))
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        monkeypatch.delenv('OUTPROC_FORCE_PROCESSING', raising=False)
+
+
+    @pytest.fixture
+    def server(self, environment):
+        server = daemon.Server(str(daemon.socket_path()), Application)
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+        yield server
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+    def message_test(self):
+        left, right = socket.socketpair(socket.AF_UNIX)
+        read_fd, write_fd = os.pipe()
+        try:
+            daemon._send_message(left, {'action': 'attach', 'argv': ['ü']}, [write_fd])
+            message, fds = daemon._recv_message(right)
+            assert message == {'action': 'attach', 'argv': ['ü']}
+            assert len(fds) == 1
+            os.write(fds[0], b'x')
+            os.close(fds[0])
+            assert os.read(read_fd, 1) == b'x'
+        finally:
+            for fd in (read_fd, write_fd):
+                os.close(fd)
+            left.close()
+            right.close()
+
+
+    def no_daemon_test(self, environment):
+        assert daemon.Client.connect() is None
+
+        app = Application()
+        app.basename = 'cmake'
+        app.binary = '/bin/true'
+        assert app._try_run_via_daemon() is None
+
+
+    def exec_test(self, server):
+        client = daemon.Client.connect()
+        try:
+            # NOTE Output is not a terminal and processing is not forced
+            reply = client.request('cmake', '/usr/bin/cmake')
+        finally:
+            client.close()
+        assert reply['action'] == 'exec'
+        assert reply['argv'] == sys.argv
+        # Nothing has been changed by the plugin
+        assert reply['env'] == {}
+        assert reply['unset'] == []
+
+
+    def foreign_socket_test(self, server, monkeypatch):
+        uid = os.getuid()
+        monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+        assert daemon.Client.connect() is None
+
+
+    def foreign_daemon_test(self, server, monkeypatch):
+        monkeypatch.setattr(daemon, '_peer_uid', lambda sock: os.getuid() + 1)
+        assert daemon.Client.connect() is None
+
+
+    def fallback_test(self, server):
+        client = daemon.Client.connect()
+        try:
+            assert client.request('no-such-module', '/bin/true') is None
+        finally:
+            client.close()
+
+
+    def run_test(self, server, capfd, monkeypatch):
+        monkeypatch.setenv('OUTPROC_FORCE_PROCESSING', '1')
+        # NOTE A worker is forked from this process, so it must not inherit the write end
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'one\ntwo\n')
+        os.close(write_fd)
+        client = daemon.Client.connect()
+        watcher = _Watcher()
+        try:
+            reply = client.request('cmake', '/usr/bin/cmake')
+            assert reply['action'] == 'run'
+            assert reply['pty'] is False
+            assert reply['handoff'] is False
+            # NOTE Only variables changed by the plugin are sent back
+            assert reply['env'] == {}
+            assert reply['unset'] == []
+
+            client.attach(read_fd)
+            client.wait(watcher)
+        finally:
+            os.close(read_fd)
+            watcher.close()
+            client.close()
+        # NOTE A worker writes directly to descriptors of STDOUT/STDERR
+        assert capfd.readouterr().out == 'one\ntwo\n'
+
+
+    def warm_up_test(self, environment, tmp_path):
+        shutil.copytree(str(pathlib.Path(__file__).parent.parent / 'conf'), str(tmp_path / '.outproc'))
+        server = daemon.Server(str(daemon.socket_path()), Application)
+        try:
+            server.warm_up()
+        finally:
+            server.server_close()
+        assert server.configs
+        # Colors are resolved and saved once, so workers have nothing to save
+        assert not any(config.cache_is_dirty for mtime, config in server.configs.values())
+
+
+    def reap_children_test(self, environment):
+        server = daemon.Server(str(daemon.socket_path()), Application)
+        try:
+            pid = os.fork()
+            if not pid:
+                os._exit(0)
+            server.active_children = {pid}
+            while server.active_children:
+                server.reap_children()
+        finally:
+            server.server_close()
+
+
+    def unlimited_workers_test(self):
+        # NOTE Every worker lives as long as a compiler it serves
+        assert 64 < daemon.Server.max_children
+        assert 64 < daemon.Server.request_queue_size
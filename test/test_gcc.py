@@ -22,10 +22,13 @@
 '''
 
 # Project specific imports
-from outproc.pp.gcc import _LOCATION_RE
+from outproc import stats
+from outproc.config import Config
+from outproc.pp.gcc import _bracket_depth_exceeds, _classify, _LOCATION_RE, Processor
 
 # Standard imports
 import pytest
+import time
 
 
 class complier_cli_match_tester:
@@ -44,3 +47,104 @@ class complier_cli_match_tester:
         assert bool(match)
         assert match.start() == expected_start
         assert match.end() == expected_end
+
+
+class message_classifier_tester:
+
+    @pytest.mark.parametrize(
+        'input_line, expected_category, expected_marker'
+      , [
+            ('/tmp/ccUlKMZA.o:zz.cc:function main: error: undefined reference to \'foo()\'', 'link_error', 'main')
+          , ('/tmp/ccUlKMZA.o:zz.cc:function vtable for Foo: error: undefined reference to \'foo()\'', 'link_error', 'Foo')
+          , ('apply_apply.cc:11:27: error: \'zzT\' was not declared in this scope', 'error', ' error: ')
+          , ('apply_apply.cc:11:27: warning: unused variable \'zzT\' error: ', 'error', ' error: ')
+          , ('compilation terminated.', 'terminated', 'compilation terminated.')
+          , ('apply_apply.cc:11:27: warning: unused variable \'zzT\'', 'warning', ' warning: ')
+          , ('x.cc:1:2:   [ skipping 3 instantiation contexts, use -ftemplate-backtrace-limit=0 to disable ]', 'skipping', '[ skipping 3 instantiation contexts, use -ftemplate-backtrace-limit=0 to disable ]')
+          , ('/work/xxx/xxx-devel/task_manager.cc: In member function \'void foo()\':', 'notice', ' In member function')
+          , ('In file included from /work/xxx/xxx-devel/details/pre_task.hh:23:0,', 'notice', 'In file included from ')
+          , ('                 from /work/xxx/xxx-devel/task.hh:18,', 'notice', '                 from ')
+          , ('x.cc:12:3:   recursively required by substitution of \'foo\'', 'notice', '   recursively required by substitution of ')
+          , ('x.cc: At global scope:', 'notice', 'At global scope:')
+          , ('x.cc:1:2: note: previous definition here', 'prev_definition', ' previous definition here')
+          , ('x.cc:1:2: note: candidate: \'void foo()\'', 'note', ' note: ')
+          , ('   foo(v, 1);', None, None)
+          , ('make[2]: Leaving directory', None, None)
+          , ('', None, None)
+        ]
+      )
+    def classify_test(self, input_line, expected_category, expected_marker):
+        categories = ['link_error', 'error', 'terminated', 'warning', 'skipping', 'notice', 'prev_definition', 'note']
+        category, found = _classify(input_line)
+        if expected_category is None:
+            assert category is None
+        else:
+            assert categories[category] == expected_category
+            assert input_line[found.start:found.end] == expected_marker
+
+
+@pytest.mark.parametrize(
+    'snippet, limit, expected'
+  , [
+        ('std::vector<std::pair<int, long>>', 2, False)
+      , ('std::vector<std::pair<int, long>>', 1, True)
+      , ('f(a<b>, c<d>, e<f>)', 2, False)
+      , ('a < b) < c', 1, False)
+      , (10 * '<', 9, True)
+    ]
+  )
+def bracket_depth_test(snippet, limit, expected):
+    assert _bracket_depth_exceeds(snippet, limit) == expected
+
+
+class guardrails_tester:
+
+    @pytest.fixture
+    def processor(self, tmp_path):
+        conf = tmp_path / 'gcc.conf'
+        conf.write_text(
+            'max-code-snippet-length = 20\n'
+            'max-formatted-snippet-size = 50\n'
+            'max-colored-snippet-size = 80\n'
+            'max-bracket-depth = 3\n'
+            'line-time-budget = 1\n'
+          )
+        stats.reset()
+        yield Processor(Config(conf, use_cache=False), 'gcc')
+        stats.reset()
+
+
+    def formatted_snippet_test(self, processor):
+        result = processor._handle_code_snippet('std::pair<std::vector<int>, long>', '', False)
+        assert '\n' in result
+        assert not stats.get('guard-snippet-size')
+
+
+    def snippet_size_test(self, processor):
+        snippet = 'std::pair<std::vector<int>, std::vector<long>, std::list<long>>'
+        result = processor._handle_code_snippet(snippet, '', False)
+        assert '\n' not in result and snippet not in result     # Colored but not formatted
+        assert stats.get('guard-snippet-size') == 1
+
+
+    def bracket_depth_test(self, processor):
+        result = processor._handle_code_snippet('a<b<c<d<int>>>>', '', False)
+        assert '\n' not in result
+        assert stats.get('guard-bracket-depth') == 1
+
+
+    def uncolored_snippet_test(self, processor):
+        snippet = 'std::pair<int, long>, ' * 4
+        assert processor._handle_code_snippet(snippet, '', False).endswith(snippet)
+        assert stats.get('guard-uncolored-snippets') == 1
+
+
+    def line_time_budget_test(self, processor, monkeypatch):
+        clock = iter([0, 0, 1])                             # Deadline, 1st snippet, 2nd one
+        monkeypatch.setattr(time, 'monotonic', lambda: next(clock, 1))
+        line = "x.cc:1:2: error: 'int' vs 'long'"
+        result = processor._try_line_with_quoted_code(line, '')
+        assert result.endswith("' vs 'long'")
+        assert "'int'" not in result
+        assert stats.get('guard-line-time-budget') == 1
+        assert processor.over_budget
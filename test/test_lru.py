@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for LRU cache
+'''
+
+# Project specific imports
+from outproc.lru import LRUCache
+
+
+class lru_cache_tester:
+
+    def hit_and_miss_test(self):
+        cache = LRUCache(100)
+        assert cache.get('one') is None
+        cache.put('one', '1')
+        assert cache.get('one') == '1'
+        assert (cache.hits, cache.misses) == (1, 1)
+
+
+    def evict_least_recently_used_test(self):
+        cache = LRUCache(6)
+        cache.put('a', '11')
+        cache.put('b', '22')
+        assert cache.get('a') == '11'                       # Now `b` is the least recently used
+        cache.put('c', '33')
+        assert cache.get('b') is None
+        assert cache.get('a') == '11'
+        assert cache.get('c') == '33'
+        assert cache.size == 6
+        assert cache.evictions == 1
+
+
+    def replace_test(self):
+        cache = LRUCache(10)
+        cache.put('a', '1')
+        cache.put('a', '1234')
+        assert cache.size == 5
+        assert len(cache) == 1
+
+
+    def huge_entry_test(self):
+        cache = LRUCache(10)
+        cache.put('a', '1')
+        cache.put('b', '1' * 100)
+        assert cache.get('b') is None
+        assert cache.get('a') == '1'
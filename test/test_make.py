@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''
+    Unit tests for `make` post-processor
+'''
+
+# Project specific imports
+from outproc.config import Config
+from outproc.parallel import ParallelProcessor
+from outproc.pp.gcc import Processor as GccProcessor
+from outproc.pp.make import Processor
+
+# Standard imports
+import os
+import pytest
+
+
+_DIAGNOSTIC = "/tmp/x.cc:3:5: error: 'foo' was not declared in this scope"
+_SNIPPET = '     foo(v, 1);'
+_CARET = '     ^'
+
+
+class embedded_gcc_tester:
+
+    @pytest.fixture
+    def make_config(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        (tmp_path / '.outproc').mkdir()
+        (tmp_path / '.outproc' / 'gcc.conf').write_text('max-code-snippet-length = 40\n')
+        conf = tmp_path / '.outproc' / 'make.conf'
+        conf.write_text('')
+        return conf
+
+
+    @pytest.fixture
+    def gcc(self, make_config):
+        return GccProcessor(Config(make_config.parent / 'gcc.conf', use_cache=False), 'gcc')
+
+
+    @pytest.fixture
+    def make(self, make_config):
+        return Processor(Config(make_config, use_cache=False), 'make')
+
+
+    def diagnostic_test(self, make, gcc):
+        lines = [_DIAGNOSTIC, _SNIPPET, _CARET, "make[1]: Leaving directory '/tmp'"]
+        result = make.handle_lines(lines)
+        assert result[:2] == gcc.handle_lines(lines[:3])
+        assert result[2].startswith(make.misc)
+
+
+    def snippet_wo_caret_test(self, make):
+        result = make.handle_lines([_DIAGNOSTIC, _SNIPPET, _DIAGNOSTIC])
+        assert result[1].startswith(_SNIPPET + '\n')
+        assert result[1].endswith(result[0])
+
+
+    def eof_test(self, make):
+        assert len(make.handle_lines([_DIAGNOSTIC, _SNIPPET])) == 1
+        assert make.eof() == [_SNIPPET]
+
+
+    def cached_gcc_colors_test(self, make_config, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        Processor(Config(make_config, use_cache=False), 'make')
+        # Colors resolved by the embedded `gcc` processor are saved
+        assert Config(make_config.parent / 'gcc.conf').colors
+
+
+    def parallel_test(self, make_config):
+        lines = ['a.cc:1:2: warning: foo', 'cd /tmp && /usr/bin/g++ -c a.cc', '   int x;', '      ^', 'done']
+        make = Processor(Config(make_config, use_cache=False), 'make')
+        expected = make.handle_lines(lines)
+        pp = ParallelProcessor(Processor(Config(make_config, use_cache=False), 'make'), 2)
+        try:
+            assert pp.handle_lines(lines) == expected
+        finally:
+            pp.eof()
+        assert expected[2:] == lines[2:]
+
+
+    def disabled_test(self, make_config):
+        make_config.write_text('handle-gcc-diagnostics = false\n')
+        make = Processor(Config(make_config, use_cache=False), 'make')
+        assert make.handle_lines([_DIAGNOSTIC, _SNIPPET, _CARET]) == [_DIAGNOSTIC, _SNIPPET, _CARET]
+
+
+class compile_command_tester:
+
+    @pytest.fixture
+    def make(self, tmp_path):
+        (tmp_path / 'bin').mkdir()
+        for name in ('g++', 'clang++'):
+            (tmp_path / 'bin' / name).write_text('')
+        conf = tmp_path / 'make.conf'
+        conf.write_text('handle-gcc-diagnostics = false\nknown-compilers = g++ gcc\n')
+        return Processor(Config(conf, use_cache=False), 'make')
+
+
+    @pytest.mark.parametrize(
+        'line, expected'
+      , [
+            ('cd {0} && {0}/bin/g++ -I/usr/include -c x.cc', True)
+          , ('cd {0} && "{0}/bin/g++" -c x.cc', True)
+          , ('{0}/bin/g++ -c x.cc', True)
+          , ('cd {0} && {0}/bin/clang++ -c x.cc', False)
+          , ('cd {0} && {0}/bin/gcc -c x.cc', False)
+          , ('cd {0} && {0}/bin/g++-13 -c x.cc', False)
+          , ("[ 12%] Building CXX object with 'unbalanced quote", False)
+        ]
+      )
+    def detect_test(self, make, tmp_path, line, expected):
+        assert make._is_look_like_cmake_compile(line.format(tmp_path))[0] == expected
+
+
+    def prefilter_test(self, make, monkeypatch):
+        def unexpected(*args):
+            assert False, 'Line must not be tokenized'
+        monkeypatch.setattr('shlex.split', unexpected)
+        assert make._is_look_like_cmake_compile('[ 12%] Linking CXX executable gcc-tool') == (False, [], 0)
+
+
+    def stat_cache_test(self, make, tmp_path, monkeypatch):
+        calls = []
+        isfile = os.path.isfile
+        monkeypatch.setattr('os.path.isfile', lambda path: calls.append(path) or isfile(path))
+        line = 'cd {0} && {0}/bin/g++ -c x.cc'.format(tmp_path)
+        for _ in range(3):
+            assert make._is_look_like_cmake_compile(line)[0]
+        assert calls == [str(tmp_path / 'bin' / 'g++')]
+
+
+    def colorize_options_test(self, make, tmp_path):
+        line = '{0}/bin/g++ -DX=-fPIC -fPIC -I /usr/include -c x.cc'.format(tmp_path)
+        reset = make.config.color.reset
+        assert make.handle_line(line) == '{0}/bin/g++ {1}-DX=-fPIC{4} {2}-fPIC{4} {3}-I{4} {3}/usr/include{4} -c x.cc'.format(
+            tmp_path
+          , make.macro_define
+          , make.optimization
+          , make.include
+          , reset
+          )
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for the bypass manifest
+'''
+
+# Project specific imports
+from outproc.manifest import can_bypass, MANIFEST
+
+# Standard imports
+import importlib
+import io
+import os
+import subprocess
+import sys
+import pytest
+
+
+# Import time ceiling for the bypass path (in microseconds)
+_IMPORT_TIME_LIMIT = 20000
+
+
+class _FakeStdout(io.StringIO):
+
+    def __init__(self, isatty):
+        super().__init__()
+        self.tty = isatty
+
+
+    def isatty(self):
+        return self.tty
+
+
+class manifest_tester:
+
+    @pytest.mark.parametrize('module', ['cmake', 'diff', 'gcc', 'make', 'mount'])
+    @pytest.mark.parametrize(
+        'argv'
+      , [
+            []
+          , ['-c', 'foo.cc']
+          , ['-MM', 'foo.cc']
+          , ['--help']
+          , ['menuconfig']
+          , ['--color=always', 'a', 'b']
+          , ['--color=no', 'a', 'b']
+        ]
+      )
+    @pytest.mark.parametrize('isatty', [False, True])
+    @pytest.mark.parametrize('forced', [False, True])
+    def consistency_test(self, monkeypatch, module, argv, isatty, forced):
+        '''Make sure a module would not handle an output when the manifest says so'''
+        argv = [module] + argv
+        if not can_bypass(module, argv, isatty, forced):
+            return
+
+        processor = importlib.import_module('outproc.pp.' + module).Processor
+        monkeypatch.setattr(sys, 'argv', list(argv))
+        monkeypatch.setattr(sys, 'stdout', _FakeStdout(isatty))
+        monkeypatch.setenv('OUTPROC_FORCE_PROCESSING', str(int(forced)))
+        assert not processor.want_to_handle_current_command()
+
+
+    def unknown_module_test(self):
+        assert not can_bypass('unknown', ['unknown'], False, False)
+        assert 'unknown' not in MANIFEST
+
+
+    def import_time_test(self):
+        '''The bypass path must not import heavy modules'''
+        output = subprocess.run(
+            [
+                sys.executable
+              , '-X', 'importtime'
+              , '-c', 'import outproc.launcher, sys; print(" ".join(sys.modules))'
+            ]
+          , stdout=subprocess.PIPE
+          , stderr=subprocess.PIPE
+          , universal_newlines=True
+          , check=True
+          , cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+          )
+        modules = output.stdout.split()
+        for heavy in ('outproc.cli', 'outproc.config', 'outproc.cpp_helpers', 'outproc.pp', 'termcolor'):
+            assert heavy not in modules
+
+        # import time: self [us] | cumulative | imported package
+        cumulative = 0
+        for line in output.stderr.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] in ('outproc', 'outproc.launcher'):
+                cumulative += int(fields[1])
+        assert 0 < cumulative < _IMPORT_TIME_LIMIT
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for span-based line markup
+'''
+
+# Project specific imports
+from outproc.markup import Markup
+
+# Standard imports
+import pytest
+
+
+class markup_tester:
+
+    @pytest.mark.parametrize(
+        'spans, expected'
+      , [
+            ([], 'Hello Africa')
+          , ([(0, 0, '<R>')], 'Hello Africa')
+          , ([(0, 5, '<R>')], '<R>Hello<N> Africa')
+          , ([(6, 12, '<R>')], 'Hello <R>Africa<N>')
+          , ([(0, 5, '<R>'), (6, 12, '<G>')], '<R>Hello<N> <G>Africa<N>')
+          , ([(6, 12, '<G>'), (0, 5, '<R>')], '<R>Hello<N> <G>Africa<N>')
+          , ([(0, 5, '<R>'), (5, 12, '<G>')], '<R>Hello<N><G> Africa<N>')
+            # Nested spans
+          , ([(0, 12, '<R>'), (6, 12, '<G>')], '<R>Hello <G>Africa<N>')
+          , ([(0, 12, '<R>'), (2, 4, '<G>')], '<R>He<G>ll<R>o Africa<N>')
+          , ([(0, 12, '<R>'), (0, 4, '<G>')], '<R><G>Hell<R>o Africa<N>')
+            # A later span paints over an earlier one
+          , ([(2, 4, '<G>'), (0, 12, '<R>')], '<R>He<G><R>ll<N><R>o Africa<N>')
+            # Crossing spans
+          , ([(0, 8, '<R>'), (4, 12, '<G>')], '<R>Hell<G>o Af<N><G>rica<N>')
+        ]
+      )
+    def render_test(self, spans, expected):
+        markup = Markup('Hello Africa', '<N>')
+        for start, end, style in spans:
+            markup.add(start, end, style)
+        assert markup.render() == expected
+
+
+    def restore_test(self):
+        markup = Markup('Hello Africa', '<N>') \
+          .add(0, 5, '<R>') \
+          .add(4, 5, '<BG>', '</BG>') \
+          .add(7, 8, '<BG>', '</BG>')
+        assert markup.render() == '<R>Hell<BG>o</BG><N> A<BG>f</BG>rica'
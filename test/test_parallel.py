@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for ordered parallel processing
+'''
+
+# Project specific imports
+from outproc import stats
+from outproc.config import Config
+from outproc.parallel import ParallelProcessor
+from outproc.pp.gcc import Processor as GccProcessor
+from outproc.shared_cache import SharedCache
+from outproc.processing import Processor
+
+# Standard imports
+import os
+import pathlib
+import sqlite3
+
+
+class _TaggingProcessor(Processor):
+
+    def __init__(self, config, binary):
+        super().__init__(config, binary)
+        self.count = 0
+
+
+    def is_independent_line(self, line):
+        return line.startswith('!')
+
+
+    def handle_line(self, line):
+        if line == '!hidden':
+            return None
+        if self.is_independent_line(line):
+            return '{}@{}'.format(line, os.getpid())
+        self.count += 1
+        return '{}#{}'.format(line, self.count)
+
+
+class parallel_processor_tester:
+
+    def setup_method(self):
+        self.config = Config(pathlib.Path('doesnt-matter'))
+
+
+    def supported_by_test(self):
+        assert ParallelProcessor.supported_by(_TaggingProcessor(self.config, 'cat'))
+        assert not ParallelProcessor.supported_by(Processor(self.config, 'cat'))
+
+
+    def ordered_output_test(self):
+        processor = _TaggingProcessor(self.config, 'cat')
+        pp = ParallelProcessor(processor, 2)
+        try:
+            lines = pp.handle_block(b'one\n!a\n!b\n!hidden\ntwo\n!c\nthr')
+            assert [line.split('@')[0] for line in lines] == ['one#1', '!a', '!b', 'two#2', '!c']
+            # Independent lines are handled by other processes
+            assert all(int(line.split('@')[1]) != os.getpid() for line in lines if '@' in line)
+            assert pp.handle_block(b'ee\n') == ['three#3']
+            assert pp.handle_block(b'!d') == []
+        finally:
+            assert pp.eof()[0].startswith('!d@')
+
+
+    def worker_shared_cache_test(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        stats.reset()
+        conf = tmp_path / 'gcc.conf'
+        conf.write_text('shared-diagnostic-cache-size = 65536\n')
+        pp = ParallelProcessor(GccProcessor(Config(conf, use_cache=False), 'gcc'), 2)
+        try:
+            # NOTE The first line makes `gcc` choose a compiler messages mode
+            pp.handle_lines(['/tmp/x.cc: In function int main():', "/tmp/x.cc:3:5: error: 'foo' was not declared in this scope"])
+            assert stats.get('parallel-lines') == 1
+        finally:
+            pp.eof()
+        # Entries rendered by workers are written when the pool shuts down
+        filename = SharedCache.in_cache_dir('diagnostics', 1).filename
+        with sqlite3.connect(filename) as connection:
+            assert connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0] == 1
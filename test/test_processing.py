@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for base processor
+'''
+
+# Project specific imports
+from outproc import stats
+from outproc.cli import Application
+from outproc.config import Config
+from outproc.processing import HANDOFF_MARKER, handoff_environment, handoff_requested, LineSplitter, Processor
+
+# Standard imports
+import os
+import pathlib
+import pytest
+import sys
+
+
+class line_splitter_tester:
+
+    @pytest.mark.parametrize(
+        'blocks, expected_lines, expected_tail'
+      , [
+            ([b'one\ntwo\n'], ['one', 'two'], '')
+          , ([b'one\ntw', b'o\nthree'], ['one', 'two'], 'three')
+          , ([b'o', b'n', b'e', b'\n'], ['one'], '')
+          , ([b'one', b'\n\n', b'two\n'], ['one', '', 'two'], '')
+          , ([b'\n'], [''], '')
+          , ([b'one\ntwo'], ['one'], 'two')
+            # Multibyte character split between blocks
+          , ([b'\xd0', b'\x9f\xd1\x80\xd0\xb8\n\xd0', b'\xb2'], ['При'], 'в')
+        ]
+      )
+    def split_test(self, blocks, expected_lines, expected_tail):
+        splitter = LineSplitter()
+        lines = []
+        for block in blocks:
+            lines += splitter.split(block)
+        assert lines == expected_lines
+        assert splitter.flush() == expected_tail
+        assert splitter.flush() == ''
+
+
+class base_processor_tester:
+
+    def setup_method(self):
+        self.config = Config(pathlib.Path('doesnt-matter'))
+
+
+    def handle_block_test(self):
+        pp = Processor(self.config, 'cat')
+        assert pp.handle_block(b'one\ntw') == ['one']
+        assert pp.handle_block(b'o\n') == ['two']
+        assert pp.handle_block(b'three') == []
+        assert pp.eof() == ['three']
+
+
+    def hide_lines_test(self):
+        pp = Processor(self.config, 'cat')
+        pp.handle_line = lambda line: None if line.startswith('#') else line
+        assert pp.handle_block(b'one\n# hidden\ntwo\n') == ['one', 'two']
+
+
+    def hidden_tail_test(self):
+        pp = Processor(self.config, 'cat')
+        pp.handle_line = lambda line: None if line.startswith('#') else line
+        assert pp.handle_block(b'one\n# hidden') == ['one']
+        assert pp.eof() == []
+
+
+class handoff_tester:
+
+    def setup_method(self):
+        self.config = Config(pathlib.Path('doesnt-matter'))
+        stats.reset()
+
+
+    def teardown_method(self):
+        stats.reset()
+
+
+    def pass_through_test(self):
+        pp = Processor(self.config, 'cat')
+        pp.handle_line = lambda line: line.upper()
+        assert pp.handle_block((HANDOFF_MARKER + 'final\nraw\n').encode()) == ['final', 'RAW']
+        assert stats.get('handoff-lines') == 1
+
+
+    def pass_through_tail_test(self):
+        pp = Processor(self.config, 'cat')
+        pp.handle_line = lambda line: line.upper()
+        assert pp.handle_block((HANDOFF_MARKER + 'fin').encode()) == []
+        assert pp.eof() == ['fin']
+
+
+    def requested_test(self, monkeypatch):
+        read_fd, write_fd = os.pipe()
+        other_read_fd, other_write_fd = os.pipe()
+        try:
+            monkeypatch.delenv('OUTPROC_HANDOFF', raising=False)
+            monkeypatch.setattr(sys, 'stdout', open(write_fd, 'w', closefd=False))
+            assert not handoff_requested()
+
+            monkeypatch.setenv('OUTPROC_HANDOFF', handoff_environment(other_write_fd)['OUTPROC_HANDOFF'])
+            assert not handoff_requested()
+
+            # NOTE Both ends of a pipe are the same file
+            monkeypatch.setenv('OUTPROC_HANDOFF', handoff_environment(read_fd)['OUTPROC_HANDOFF'])
+            assert handoff_requested()
+        finally:
+            for fd in (read_fd, write_fd, other_read_fd, other_write_fd):
+                os.close(fd)
+
+
+    def round_trip_test(self, capsys):
+        app = Application()
+        app.mark_lines = True
+        app._out_lines_list(['one', 'two\n  three'])
+
+        pp = Processor(self.config, 'cat')
+        pp.handle_line = lambda line: None
+        assert pp.handle_block(capsys.readouterr().out.encode()) == ['one', 'two', '  three']
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for decoupled reader
+'''
+
+# Project specific imports
+from outproc.reader import BlockBuffer, Reader
+
+# Standard imports
+import os
+import threading
+
+
+class block_buffer_tester:
+
+    def take_all_test(self):
+        buffer = BlockBuffer(capacity=100)
+        buffer.put(b'one\n')
+        buffer.put(b'two\n')
+        assert buffer.max_size == 8
+        assert buffer.take() == b'one\ntwo\n'
+        buffer.close()
+        assert buffer.take() is None
+
+
+    def full_buffer_test(self):
+        buffer = BlockBuffer(capacity=4)
+        buffer.put(b'12345')                                # Exceeding block is accepted
+
+        writer = threading.Thread(target=buffer.put, args=(b'6',))
+        writer.start()
+        writer.join(0.05)
+        assert writer.is_alive()                            # Waiting for a free room
+
+        assert buffer.take() == b'12345'
+        writer.join()
+        assert buffer.take() == b'6'
+        assert buffer.stall_time > 0
+
+
+class reader_tester:
+
+    def read_pipe_test(self):
+        rfd, wfd = os.pipe()
+        data = b'line\n' * 100000
+        buffer = BlockBuffer(capacity=1024)
+        with open(rfd, 'rb') as stream:
+            reader = Reader(stream, buffer)
+            reader.start()
+            writer = threading.Thread(target=lambda: (os.write(wfd, data), os.close(wfd)))
+            writer.start()
+
+            result = b''
+            block = buffer.take()
+            while block is not None:
+                result += block
+                block = buffer.take()
+            reader.join()
+            writer.join()
+
+        assert reader.error is None
+        assert result == data
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for wrapped executable lookup
+'''
+
+# Project specific imports
+from outproc import resolver
+
+# Standard imports
+import os
+import pytest
+
+
+def _make_executable(filename):
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    filename.write_text('#!/bin/sh\n')
+    filename.chmod(0o755)
+    return str(filename)
+
+
+class resolver_tester:
+
+    @pytest.fixture(autouse=True)
+    def setup_dirs(self, tmp_path, monkeypatch):
+        self.root = tmp_path
+        self.outproc = _make_executable(tmp_path / 'outproc-real' / 'outproc')
+        self.farm = tmp_path / 'farm'
+        self.farm.mkdir()
+        (self.farm / 'gcc').symlink_to(self.outproc)
+        self.first = tmp_path / 'first'
+        self.first.mkdir()
+        self.second = tmp_path / 'second'
+        self.binary = _make_executable(self.second / 'gcc')
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        monkeypatch.setenv('PATH', os.pathsep.join(str(p) for p in (self.farm, self.first, self.second)))
+
+
+    def find_test(self):
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+        assert resolver.find_wrapped_binary('clang', self.outproc) is None
+        assert (self.root / 'cache' / 'outproc' / 'binaries' / 'gcc').exists()
+        # Cached result
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+
+
+    def cache_hit_test(self, monkeypatch):
+        resolver.find_wrapped_binary('gcc', self.outproc)
+        monkeypatch.setattr(resolver, '_walk_path', None)   # Must not be called
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+
+
+    def invalidate_on_new_binary_test(self):
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+        binary = _make_executable(self.first / 'gcc')
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == binary
+
+
+    def invalidate_on_removed_binary_test(self):
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+        os.unlink(self.binary)
+        assert resolver.find_wrapped_binary('gcc', self.outproc) is None
+
+
+    def invalidate_on_path_change_test(self, monkeypatch):
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
+        binary = _make_executable(self.root / 'third' / 'gcc')
+        monkeypatch.setenv('PATH', str(self.root / 'third'))
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == binary
+
+
+    def read_only_cache_test(self, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(self.root / 'outproc-real' / 'outproc'))
+        assert resolver.find_wrapped_binary('gcc', self.outproc) == self.binary
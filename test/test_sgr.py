@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for redundant SGR sequences removal
+'''
+
+# Project specific imports
+from outproc import stats
+from outproc.cli import Application
+from outproc.sgr import optimize
+
+# Standard imports
+import pytest
+
+
+class sgr_tester:
+
+    @pytest.mark.parametrize(
+        'text, expected'
+      , [
+            ('plain', 'plain')
+          , ('\x1b[31mX\x1b[0m', '\x1b[31mX\x1b[0m')
+          , ('\x1b[0m\x1b[31mX\x1b[0m', '\x1b[0;31mX\x1b[0m')
+            # Switch to the active color
+          , ('\x1b[0m\x1b[31mX\x1b[0m\x1b[31mY\x1b[0m', '\x1b[0;31mXY\x1b[0m')
+            # Back-to-back resets (even across lines)
+          , ('\x1b[0mX\x1b[0m\x1b[0mY\x1b[0m\n\x1b[0m\x1b[33m\x1b[1mZ\x1b[0m', '\x1b[0mXY\n\x1b[1;33mZ\x1b[0m')
+            # Incremental transition is shorter than a reset
+          , ('\x1b[0m\x1b[33m\x1b[1mX\x1b[0m\x1b[33mY', '\x1b[0;1;33mX\x1b[22mY')
+          , ('\x1b[0m\x1b[41mX\x1b[49mY\x1b[0m\x1b[38;5;200mZ', '\x1b[0;41mX\x1b[0mY\x1b[38;5;200mZ')
+            # Unsupported sequences are passed as is (the state is unknown after them)
+          , ('\x1b[0m\x1b[31mX\x1b[38mY\x1b[38mZ\x1b[0m', '\x1b[0;31mX\x1b[38mY\x1b[38mZ\x1b[0m')
+            # Other escape sequences are like a printable text
+          , ('\x1b[0m\x1b[31mX\x1b[0m\x1b[5A\x1b[0mY', '\x1b[0;31mX\x1b[0m\x1b[5AY')
+        ]
+      )
+    def optimize_test(self, text, expected):
+        assert optimize(text) == expected
+
+
+    def bytes_saved_test(self):
+        stats.reset()
+        optimize('\x1b[0mX\x1b[0m\x1b[0mY')
+        assert stats.get('sgr-bytes-saved') == 8
+
+
+    @pytest.mark.parametrize('minimize_escapes', [True, False])
+    def output_test(self, capsys, minimize_escapes):
+        app = Application()
+        app.mark_lines = False
+        app.minimize_escapes = minimize_escapes
+        lines = ['\x1b[0m\x1b[31mX\x1b[0m', '\x1b[0m\x1b[31mY\x1b[0m']
+        app._out_lines_list(lines)
+        if minimize_escapes:
+            assert capsys.readouterr().out == '\x1b[0;31mX\x1b[0m\n\x1b[31mY\x1b[0m\n'
+        else:
+            assert capsys.readouterr().out == '\n'.join(lines) + '\n'
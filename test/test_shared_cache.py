@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is a part of Pluggable Output Processor
+#
+# Copyright (c) 2013-2017 Alex Turbov <i.zaufi@gmail.com>
+#
+# Pluggable Output Processor is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pluggable Output Processor is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+    Unit tests for the shared on-disk cache
+'''
+
+# Project specific imports
+from outproc.shared_cache import make_key, SharedCache
+
+# Standard imports
+import multiprocessing
+
+
+def _fill(filename, start):
+    cache = SharedCache(filename, 1024 * 1024)
+    for i in range(start, start + 200):
+        key = make_key('line', i % 50)
+        value = cache.get(key)
+        assert value is None or value == 'value {}'.format(i % 50)
+        cache.put(key, 'value {}'.format(i % 50))
+    cache.flush()
+    return cache.disabled
+
+
+class shared_cache_tester:
+
+    def make_key_test(self):
+        assert make_key('a', 1) == make_key('a', 1)
+        assert make_key('a', 1) != make_key('a1')
+        assert make_key('a', None) != make_key('a', 'b')
+
+
+    def get_put_test(self, tmp_path):
+        cache = SharedCache(str(tmp_path / 'cache.sqlite'), 1000)
+        assert cache.get(make_key('one')) is None
+        cache.put(make_key('one'), 'rendered one')
+        assert cache.get(make_key('one')) is None           # Not flushed yet
+        cache.flush()
+        assert cache.get(make_key('one')) == 'rendered one'
+
+        # The other process (connection) sees the same data
+        other = SharedCache(str(tmp_path / 'cache.sqlite'), 1000)
+        assert other.get(make_key('one')) == 'rendered one'
+
+
+    def eviction_test(self, tmp_path):
+        cache = SharedCache(str(tmp_path / 'cache.sqlite'), 100)
+        for i in range(2000):
+            cache.put(make_key(i), '0123456789')
+        cache.flush()
+        total = cache.connection.execute('SELECT TOTAL(size) FROM entries').fetchone()[0]
+        assert total < 2000 * 10
+        assert cache.get(make_key(1999)) == '0123456789'
+
+
+    def unusable_database_test(self, tmp_path):
+        filename = tmp_path / 'cache.sqlite'
+        filename.write_bytes(b'definitely not a database' * 100)
+        cache = SharedCache(str(filename), 100)
+        assert cache.get(make_key('one')) is None
+        cache.put(make_key('one'), 'rendered one')
+        cache.flush()
+        assert cache.disabled
+
+
+    def concurrent_access_test(self, tmp_path):
+        filename = str(tmp_path / 'cache.sqlite')
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            results = pool.starmap(_fill, [(filename, i * 10) for i in range(8)])
+        assert not any(results)
+        cache = SharedCache(filename, 1024 * 1024)
+        assert cache.get(make_key('line', 7)) == 'value 7'